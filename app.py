@@ -1,11 +1,44 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, Response, abort, g, has_request_context, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, stream_with_context
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from PIL import Image, ImageOps
+import click
+import csv
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import logging
+import mimetypes
+import multiprocessing
 import os
-from datetime import datetime
-from sqlalchemy.orm import joinedload
+import platform
+import random
+import re
+import select
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from sqlalchemy import and_, case, event, inspect, or_, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import Session, aliased, joinedload
+from sqlalchemy.pool import Pool
+from sqlalchemy.schema import CreateIndex
+
+# Необязательная зависимость: без нее сборка статики создает только .gz
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 
@@ -21,6 +54,35 @@ if database_url:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
 
+# Пул на каждый процесс gunicorn: соединений к PostgreSQL будет не больше
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW), это число должно помещаться в
+# max_connections базы. pre_ping отбрасывает соединения, закрытые сервером,
+# recycle — соединения старше DB_POOL_RECYCLE секунд.
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    }
+else:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+# WAL позволяет читать, пока другой процесс пишет; при занятой базе запрос
+# ждет до SQLITE_BUSY_TIMEOUT мс вместо немедленной ошибки "database is locked"
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+)
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/images/products'
 
@@ -38,9 +100,9 @@ class User(UserMixin, db.Model):
     password = db.Column(db.String(200), nullable=False)
     visible_password = db.Column(db.String(80), nullable=True)
     first_name = db.Column(db.String(80), nullable=False)
-    last_name = db.Column(db.String(80), nullable=False)
-    role = db.Column(db.String(20), nullable=False)  # admin, teacher, student
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True)
+    last_name = db.Column(db.String(80), nullable=False, index=True)
+    role = db.Column(db.String(20), nullable=False, index=True)  # admin, teacher, student
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True, index=True)
     points = db.Column(db.Integer, default=0)
     earned_points = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -50,6 +112,10 @@ class User(UserMixin, db.Model):
                                      foreign_keys='PointsHistory.user_id')
     orders = db.relationship('Order', backref='student', lazy=True, 
                             foreign_keys='Order.student_id')
+    
+    __table_args__ = (
+        db.Index('ix_user_group_role_earned_points', 'group_id', 'role', 'earned_points'),
+    )
 
 class Group(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -67,6 +133,20 @@ class PointsHistory(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     changed_by = db.relationship('User', foreign_keys=[changed_by_id])
+    
+    __table_args__ = (
+        db.Index('ix_points_history_user_created_at', 'user_id', 'created_at'),
+    )
+
+# Итоги истории баллов ученика до записи last_history_id включительно,
+# чтобы сверять баланс, не перечитывая всю историю
+class PointsSnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    last_history_id = db.Column(db.Integer, nullable=False, default=0)
+    balance = db.Column(db.Integer, nullable=False, default=0)
+    earned = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class RewardReason(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -87,13 +167,27 @@ class Product(db.Model):
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, default=1)
+    # Цена за штуку на момент покупки; у старых заказов пустая
+    price = db.Column(db.Integer, nullable=True)
     status = db.Column(db.String(20), default='pending')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     product = db.relationship('Product')
+    
+    __table_args__ = (
+        db.Index('ix_order_status_created_at', 'status', 'created_at'),
+    )
+    
+    @property
+    def unit_price(self):
+        return self.price if self.price is not None else self.product.price
+
+# Цена заказа в запросах с join на Product: заказы до появления Order.price
+# считаются по текущей цене товара
+ORDER_PRICE = db.func.coalesce(Order.price, Product.price)
 
 class Tip(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -155,9 +249,855 @@ class TipItem(db.Model):
     points = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+# Сообщения шины инвалидации кэшей для баз без LISTEN/NOTIFY
+class CacheInvalidation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# ========== КЭШ ==========
+# Небольшой кэш в памяти процесса. Запись живет не дольше своего TTL и
+# сбрасывается сразу после коммита, который изменил одну из ее таблиц.
+# Хранить в кэше можно только простые значения, а не объекты моделей.
+_cache = {}
+_cache_lock = threading.Lock()
+_cache_generation = 0
+
+def cached(key, ttl, loader, tables=()):
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        generation = _cache_generation
+    if entry and entry[0] > now:
+        return entry[1]
+    
+    value = loader()
+    with _cache_lock:
+        # Если пока loader читал базу кто-то сбросил кэш, значение может быть устаревшим
+        if generation == _cache_generation:
+            _cache[key] = (now + ttl, value, frozenset(tables))
+    return value
+
+def invalidate_tables(tables):
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        stale = [key for key, entry in _cache.items() if entry[2] & tables]
+        for key in stale:
+            del _cache[key]
+
+def mark_tables_changed(session, tables):
+    session.info.setdefault('changed_tables', set()).update(tables)
+
+def mark_users_changed(session, user_ids):
+    session.info.setdefault('changed_user_ids', set()).update(user_ids)
+
+@event.listens_for(Session, 'after_flush')
+def track_flushed_tables(session, flush_context):
+    objects = list(session.new) + list(session.dirty) + list(session.deleted)
+    mark_tables_changed(session, {obj.__table__.name for obj in objects})
+    mark_users_changed(session, {obj.id for obj in objects if isinstance(obj, User)})
+
+# Массовые UPDATE/INSERT/DELETE через session.execute минуют flush. Если такой
+# запрос меняет пользователей, он может перечислить их в execution_options
+# (changed_user_ids), иначе сбрасываются снимки всех пользователей.
+@event.listens_for(Session, 'do_orm_execute')
+def track_executed_tables(orm_execute_state):
+    statement = orm_execute_state.statement
+    if getattr(statement, 'is_dml', False):
+        session = orm_execute_state.session
+        mark_tables_changed(session, {statement.table.name})
+        if statement.table.name == User.__tablename__:
+            user_ids = orm_execute_state.execution_options.get('changed_user_ids')
+            mark_users_changed(session, ALL_USERS if user_ids is None else user_ids)
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed_tables(session):
+    tables = session.info.pop('changed_tables', None)
+    if tables:
+        invalidate_tables(tables)
+    
+    user_ids = session.info.pop('changed_user_ids', None)
+    if user_ids:
+        forget_user_snapshots(user_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_rolled_back_tables(session):
+    session.info.pop('changed_tables', None)
+    session.info.pop('changed_user_ids', None)
+
+# ========== ТЕКУЩИЙ ПОЛЬЗОВАТЕЛЬ ==========
+# Для проверки входа и роли достаточно снимка основных полей пользователя.
+# Снимки лежат в ограниченном LRU-кэше, поэтому обычная страница не делает
+# запросов только ради current_user. Остальные атрибуты (group, orders, ...)
+# и изменения идут через строку из БД, которая загружается при обращении.
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 30
+USER_SNAPSHOT_FIELDS = ('id', 'username', 'first_name', 'last_name', 'role', 
+                        'group_id', 'points', 'earned_points', 'created_at')
+ALL_USERS = {'*'}
+
+_user_snapshots = OrderedDict()
+_user_snapshots_lock = threading.Lock()
+_user_snapshots_generation = 0
+
+class SessionUser(UserMixin):
+    def __init__(self, fields, db_user=None):
+        self.__dict__.update(fields)
+        self._db_user = db_user
+    
+    @property
+    def db_user(self):
+        if self._db_user is None:
+            self._db_user = User.query.get(self.id)
+        return self._db_user
+    
+    def __getattr__(self, name):
+        # Вызывается только для атрибутов, которых нет в снимке
+        if name.startswith('_') or name == 'db_user':
+            raise AttributeError(name)
+        return getattr(self.db_user, name)
+
+def forget_user_snapshots(user_ids):
+    global _user_snapshots_generation
+    with _user_snapshots_lock:
+        _user_snapshots_generation += 1
+        if '*' in user_ids:
+            _user_snapshots.clear()
+            return
+        for user_id in user_ids:
+            _user_snapshots.pop(user_id, None)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    now = time.monotonic()
+    
+    with _user_snapshots_lock:
+        entry = _user_snapshots.get(user_id)
+        if entry and entry[0] > now:
+            _user_snapshots.move_to_end(user_id)
+            return SessionUser(entry[1])
+        generation = _user_snapshots_generation
+    
+    user = User.query.get(user_id)
+    if user is None:
+        return None
+    
+    fields = {field: getattr(user, field) for field in USER_SNAPSHOT_FIELDS}
+    with _user_snapshots_lock:
+        # Если пока читали строку кто-то изменил пользователей, снимок может быть устаревшим
+        if generation == _user_snapshots_generation:
+            _user_snapshots[user_id] = (now + USER_CACHE_TTL, fields)
+            _user_snapshots.move_to_end(user_id)
+            while len(_user_snapshots) > USER_CACHE_SIZE:
+                _user_snapshots.popitem(last=False)
+    
+    return SessionUser(fields, db_user=user)
+
+# ========== ШИНА ИНВАЛИДАЦИИ ==========
+# Кэши выше живут в памяти каждого воркера gunicorn, поэтому о коммите одного
+# воркера должны узнать остальные. Перед коммитом в той же транзакции
+# публикуется сообщение с измененными таблицами и пользователями. На
+# PostgreSQL это NOTIFY: его получают только после коммита, и каждый воркер
+# слушает канал в отдельном потоке. На других базах сообщение пишется строкой
+# в cache_invalidation, а воркер читает новые строки перед запросом, не чаще
+# раза в CACHE_SYNC_INTERVAL секунд — это и есть предельная задержка.
+CACHE_BUS_CHANNEL = 'cache_invalidation'
+CACHE_SYNC_INTERVAL = 1.0
+CACHE_BUS_KEEP = 10000
+CACHE_BUS_MAX_USERS = 500
+
+_bus_state = {'last_id': None, 'checked_at': 0.0, 'listener_pid': None, 'table_ready': False}
+_bus_lock = threading.Lock()
+
+# Таблицу шины создают init-db и db upgrade. Пока ее нет (база еще не
+# обновлена), сообщения не пишутся и не читаются, а коммиты проходят как
+# обычно. Проверка повторяется, пока таблица не появится.
+def bus_table_ready(connection):
+    if not _bus_state['table_ready']:
+        _bus_state['table_ready'] = inspect(connection).has_table(CacheInvalidation.__tablename__)
+    return _bus_state['table_ready']
+
+def bus_origin():
+    # pid, а не значение при импорте: с --preload воркеры получили бы одно и то же
+    return f'{platform.node()}:{os.getpid()}'
+
+@event.listens_for(Session, 'before_commit')
+def publish_invalidation(session):
+    # Последний flush происходит после before_commit, поэтому делаем его сами,
+    # чтобы в сообщение попали все изменения транзакции
+    session.flush()
+    tables = session.info.get('changed_tables')
+    if not tables:
+        return
+    
+    user_ids = session.info.get('changed_user_ids') or set()
+    if '*' in user_ids or len(user_ids) > CACHE_BUS_MAX_USERS:
+        users = ['*']
+    else:
+        users = sorted(user_ids)
+    payload = json.dumps({'origin': bus_origin(), 'tables': sorted(tables), 'users': users})
+    
+    # Через connection, а не session.execute, чтобы сама запись не считалась изменением
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_notify(:channel, :payload)'), 
+                           {'channel': CACHE_BUS_CHANNEL, 'payload': payload})
+        return
+    
+    if not bus_table_ready(connection):
+        return
+    messages = CacheInvalidation.__table__
+    message_id = connection.execute(messages.insert().values(payload=payload)).inserted_primary_key[0]
+    if message_id % 1000 == 0:
+        connection.execute(messages.delete().where(messages.c.id <= message_id - CACHE_BUS_KEEP))
+
+def apply_invalidation(payload):
+    message = json.loads(payload)
+    if message['origin'] == bus_origin():
+        return
+    invalidate_tables(set(message['tables']))
+    if message['users']:
+        forget_user_snapshots(set(message['users']))
+
+def forget_all_caches():
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        _cache.clear()
+    forget_user_snapshots(ALL_USERS)
+
+def sync_invalidations():
+    now = time.monotonic()
+    with _bus_lock:
+        if now - _bus_state['checked_at'] < CACHE_SYNC_INTERVAL:
+            return
+        _bus_state['checked_at'] = now
+        last_id = _bus_state['last_id']
+    
+    messages = CacheInvalidation.__table__
+    with db.engine.connect() as connection:
+        if not bus_table_ready(connection):
+            return
+        if last_id is None:
+            # Первый запрос воркера: кэши еще пусты, старые сообщения не нужны
+            rows = []
+            last_id = connection.execute(db.select(db.func.max(messages.c.id))).scalar() or 0
+        else:
+            rows = connection.execute(
+                db.select(messages.c.id, messages.c.payload)
+                .where(messages.c.id > last_id).order_by(messages.c.id)
+            ).all()
+    
+    if rows and rows[0].id > last_id + 1:
+        # Воркер долго не читал шину, и часть сообщений уже удалена
+        forget_all_caches()
+    for row in rows:
+        apply_invalidation(row.payload)
+        last_id = row.id
+    
+    with _bus_lock:
+        _bus_state['last_id'] = max(last_id, _bus_state['last_id'] or 0)
+
+# Поток слушателя живет вне контекста приложения, поэтому движок ему передает
+# start_invalidation_listener, а не db.engine.
+def listen_invalidations(engine):
+    # Ошибки соединения с базой; остальные исключения останавливают поток
+    connection_errors = (DBAPIError, engine.dialect.dbapi.Error, OSError)
+    while True:
+        connection = None
+        try:
+            # Отдельное соединение вне пула: LISTEN держит его все время
+            connection = engine.raw_connection()
+            connection.detach()
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            dbapi_connection.cursor().execute(f'LISTEN {CACHE_BUS_CHANNEL}')
+            # Пока слушателя не было, сообщения могли потеряться
+            forget_all_caches()
+            
+            while True:
+                if select.select([dbapi_connection], [], [], 30) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    apply_invalidation(dbapi_connection.notifies.pop(0).payload)
+        except connection_errors:
+            app.logger.exception('Шина инвалидации: соединение потеряно, переподключаемся')
+            if connection is not None:
+                try:
+                    connection.close()
+                except connection_errors:
+                    pass
+            time.sleep(1)
+
+def start_invalidation_listener():
+    with _bus_lock:
+        if _bus_state['listener_pid'] == os.getpid():
+            return
+        _bus_state['listener_pid'] = os.getpid()
+    threading.Thread(target=listen_invalidations, args=(db.engine,),
+                     name='cache-invalidation', daemon=True).start()
+
+@app.before_request
+def receive_invalidations():
+    if request.endpoint == 'static':
+        return
+    if db.engine.dialect.name == 'postgresql':
+        start_invalidation_listener()
+    else:
+        sync_invalidations()
+
+# ========== ПУЛ СОЕДИНЕНИЙ ==========
+# Счетчики пула текущего процесса: сколько соединений открыто, выдано сейчас
+# и максимум одновременно выданных. По ним видно, хватает ли DB_POOL_SIZE
+# на потоки воркера.
+_pool_stats = {'connects': 0, 'checkouts': 0, 'checked_out': 0, 'peak_checked_out': 0}
+_pool_stats_lock = threading.Lock()
+
+@event.listens_for(Engine, 'connect')
+def configure_connection(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+    with _pool_stats_lock:
+        _pool_stats['connects'] += 1
+
+@event.listens_for(Pool, 'checkout')
+def count_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    with _pool_stats_lock:
+        _pool_stats['checkouts'] += 1
+        _pool_stats['checked_out'] += 1
+        _pool_stats['peak_checked_out'] = max(_pool_stats['peak_checked_out'], _pool_stats['checked_out'])
+
+@event.listens_for(Pool, 'checkin')
+def count_pool_checkin(dbapi_connection, connection_record):
+    with _pool_stats_lock:
+        _pool_stats['checked_out'] = max(0, _pool_stats['checked_out'] - 1)
+
+def pool_status():
+    pool = db.engine.pool
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    
+    stats.update({
+        'pid': os.getpid(),
+        'backend': db.engine.dialect.name,
+        'pool_class': type(pool).__name__,
+        'pool_size': pool.size() if hasattr(pool, 'size') else None,
+        'max_overflow': app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('max_overflow'),
+        'idle': pool.checkedin() if hasattr(pool, 'checkedin') else None,
+        'overflow': max(0, pool.overflow()) if hasattr(pool, 'overflow') else None,
+    })
+    return stats
+
+# ========== ПРОФИЛИРОВАНИЕ SQL ==========
+# Включается переменной окружения SQL_PROFILE=1. Для каждого запроса считаются
+# SQL-запросы и их время, одинаковые запросы с разными параметрами (N+1)
+# собираются вместе. Итог уходит в заголовки ответа, в лог и на /admin/perf.
+# При SQL_BUDGET_STRICT=1 превышение бюджета запросов роняет ответ — этот
+# режим для проверок (flask perf check), а не для продакшена.
+SQL_REPEAT_THRESHOLD = 5
+SQL_QUERY_BUDGET = 25
+SQL_QUERY_BUDGETS = {
+    'filter_students': 5,
+    'student_shop': 5,
+    'admin_dashboard': 5,
+}
+
+app.config['SQL_PROFILE'] = os.environ.get('SQL_PROFILE') == '1'
+app.config['SQL_BUDGET_STRICT'] = os.environ.get('SQL_BUDGET_STRICT') == '1'
+if app.config['SQL_PROFILE']:
+    app.logger.setLevel(logging.INFO)
+
+_sql_profile = {}
+_sql_profile_lock = threading.Lock()
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+# Литералы и списки IN (?, ?, ...) заменяются на ?, чтобы запросы одной
+# формы считались одним запросом
+def normalize_statement(statement):
+    statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    statement = re.sub(r'\b\d+(?:\.\d+)?\b', '?', statement)
+    statement = re.sub(r'\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))*\s*\)', '(?)', statement)
+    return ' '.join(statement.split())
+
+def query_budget(endpoint):
+    return SQL_QUERY_BUDGETS.get(endpoint, SQL_QUERY_BUDGET)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if app.config['SQL_PROFILE'] and has_request_context() and 'sql_queries' in g:
+        conn.info['query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries.append((normalize_statement(statement), elapsed))
+
+@app.before_request
+def start_sql_profile():
+    if app.config['SQL_PROFILE']:
+        g.sql_queries = []
+
+# Итог по одному HTTP-запросу: статистика, лог и проверка бюджета
+def record_sql_profile(endpoint, method, queries):
+    count = len(queries)
+    total_time = sum(elapsed for _, elapsed in queries)
+    shapes = {}
+    for statement, elapsed in queries:
+        shape = shapes.setdefault(statement, [0, 0.0])
+        shape[0] += 1
+        shape[1] += elapsed
+    repeated = {statement: shape for statement, shape in shapes.items() 
+                if shape[0] >= SQL_REPEAT_THRESHOLD}
+    budget = query_budget(endpoint)
+    
+    with _sql_profile_lock:
+        stats = _sql_profile.setdefault(endpoint, {
+            'requests': 0, 'queries': 0, 'time': 0.0, 
+            'max_queries': 0, 'over_budget': 0, 'repeated': {}
+        })
+        stats['requests'] += 1
+        stats['queries'] += count
+        stats['time'] += total_time
+        stats['max_queries'] = max(stats['max_queries'], count)
+        if count > budget:
+            stats['over_budget'] += 1
+        for statement, (times, _) in repeated.items():
+            stats['repeated'][statement] = max(stats['repeated'].get(statement, 0), times)
+    
+    app.logger.info('sql %s %s queries=%d time=%.1fms repeated=%d budget=%d',
+                    method, endpoint, count, total_time * 1000, len(repeated), budget)
+    for statement, (times, _) in repeated.items():
+        app.logger.warning('N+1 в %s: %d раз %s', endpoint, times, statement[:200])
+    
+    if count > budget and app.config['SQL_BUDGET_STRICT']:
+        raise QueryBudgetExceeded(f'{endpoint}: {count} SQL-запросов при бюджете {budget}')
+    return count, total_time, repeated
+
+@app.after_request
+def finish_sql_profile(response):
+    queries = g.get('sql_queries')
+    if queries is None or request.endpoint in (None, 'static'):
+        return response
+    
+    endpoint, method = request.endpoint, request.method
+    if response.is_streamed:
+        # Тело потокового ответа (stream_with_context) читает базу уже после
+        # after_request, поэтому запросы считаются при закрытии ответа, а
+        # заголовков X-SQL-* у такого ответа нет
+        response.call_on_close(lambda: record_sql_profile(endpoint, method, queries))
+        return response
+    
+    g.pop('sql_queries')
+    count, total_time, repeated = record_sql_profile(endpoint, method, queries)
+    response.headers['X-SQL-Queries'] = str(count)
+    response.headers['X-SQL-Time'] = f'{total_time * 1000:.1f}ms'
+    if repeated:
+        response.headers['X-SQL-Repeated'] = str(len(repeated))
+    return response
+
+def sql_profile_report():
+    with _sql_profile_lock:
+        rows = [
+            {
+                'endpoint': endpoint,
+                'requests': stats['requests'],
+                'avg_queries': stats['queries'] / stats['requests'],
+                'max_queries': stats['max_queries'],
+                'avg_time': stats['time'] * 1000 / stats['requests'],
+                'budget': query_budget(endpoint),
+                'over_budget': stats['over_budget'],
+                'repeated': sorted(stats['repeated'].items(), key=lambda item: -item[1])
+            }
+            for endpoint, stats in _sql_profile.items()
+        ]
+    return sorted(rows, key=lambda row: -row['avg_time'] * row['requests'])
+
+# Рейтинг группы читается по индексу (group_id, role, earned_points), поэтому
+# он всегда актуален без отдельной таблицы мест: место ученика — один COUNT
+# по диапазону индекса, а срезы рейтинга — короткие упорядоченные выборки.
+# При равных баллах выше стоит ученик с меньшим id.
+def leaderboard_query(group_id):
+    return User.query.filter_by(group_id=group_id, role='student')
+
+def group_leaderboard(group_id, limit=None):
+    query = leaderboard_query(group_id).order_by(User.earned_points.desc(), User.id)
+    if limit is not None:
+        query = query.limit(limit)
+    
+    students = query.all()
+    for i, student in enumerate(students, 1):
+        student.rating_position = i
+    
+    return students
+
+def ranked_above(student):
+    return or_(
+        User.earned_points > student.earned_points,
+        and_(User.earned_points == student.earned_points, User.id < student.id)
+    )
+
+def ranked_below(student):
+    return or_(
+        User.earned_points < student.earned_points,
+        and_(User.earned_points == student.earned_points, User.id > student.id)
+    )
+
+def student_rank(student):
+    if not student.group_id or student.role != 'student':
+        return None
+    return leaderboard_query(student.group_id).filter(ranked_above(student)).count() + 1
+
+def leaderboard_neighbours(student, above=3, below=3):
+    rank = student_rank(student)
+    if rank is None:
+        return []
+    
+    higher = leaderboard_query(student.group_id).filter(ranked_above(student)) \
+        .order_by(User.earned_points, User.id.desc()).limit(above).all()
+    lower = leaderboard_query(student.group_id).filter(ranked_below(student)) \
+        .order_by(User.earned_points.desc(), User.id).limit(below).all()
+    
+    students = list(reversed(higher)) + [student] + lower
+    for i, neighbour in enumerate(students, rank - len(higher)):
+        neighbour.rating_position = i
+    
+    return students
+
+# Группы вместе с преподавателем и числом учеников одним запросом: счетчики
+# берутся из GROUP BY по индексу (group_id, role), а не из group.students,
+# который загрузил бы всех учеников группы ради их количества
+def groups_with_student_counts(*criteria):
+    counts = db.session.query(User.group_id, db.func.count(User.id).label('student_count')) \
+        .filter(User.role == 'student', User.group_id.isnot(None)) \
+        .group_by(User.group_id).subquery()
+    
+    rows = db.session.query(Group, db.func.coalesce(counts.c.student_count, 0)) \
+        .outerjoin(counts, counts.c.group_id == Group.id) \
+        .options(joinedload(Group.teacher)) \
+        .filter(*criteria) \
+        .order_by(Group.id).all()
+    
+    groups = []
+    for group, student_count in rows:
+        group.student_count = student_count
+        groups.append(group)
+    return groups
+
+# ========== ИСТОРИЯ БАЛЛОВ ==========
+# История баллов — журнал, в который только добавляются записи. Страницы
+# читаются по индексу (user_id, created_at) keyset-курсором, а итоги и
+# разбивка по периодам считаются агрегатами в БД.
+HISTORY_PER_PAGE = 30
+
+def history_older_than(created_at, history_id):
+    return or_(
+        PointsHistory.created_at < created_at,
+        and_(PointsHistory.created_at == created_at, PointsHistory.id < history_id)
+    )
+
+# Страница истории с балансом после каждой операции. Баланс считается от
+# текущего User.points назад, как и раньше в шаблоне профиля.
+def history_page(user, cursor=None, per_page=HISTORY_PER_PAGE):
+    query = PointsHistory.query.options(joinedload(PointsHistory.changed_by)) \
+        .filter(PointsHistory.user_id == user.id)
+    
+    newer_total = 0
+    cursor = parse_cursor(cursor)
+    if cursor:
+        try:
+            cursor_created_at = datetime.fromisoformat(cursor[0])
+        except ValueError:
+            cursor = None
+        else:
+            older = history_older_than(cursor_created_at, cursor[1])
+            query = query.filter(older)
+            newer_total = db.session.query(db.func.coalesce(db.func.sum(PointsHistory.points_change), 0)) \
+                .filter(PointsHistory.user_id == user.id, db.not_(older)).scalar()
+    
+    records = query.order_by(PointsHistory.created_at.desc(), PointsHistory.id.desc()) \
+        .limit(per_page + 1).all()
+    
+    next_cursor = None
+    if len(records) > per_page:
+        records = records[:per_page]
+        next_cursor = make_cursor(records[-1].created_at.isoformat(), records[-1].id)
+    
+    # Покупки в журнал не попадают, поэтому баланс после записи учитывает и
+    # неотмененные заказы, оформленные позже нее
+    balance = user.points - newer_total
+    page_orders = []
+    if records:
+        spent = ORDER_PRICE * Order.quantity
+        orders = db.session.query(Order.created_at, spent) \
+            .join(Product, Order.product_id == Product.id) \
+            .filter(Order.student_id == user.id, Order.status != 'cancelled', 
+                    Order.created_at > records[-1].created_at)
+        balance += orders.filter(Order.created_at > records[0].created_at) \
+            .with_entities(db.func.coalesce(db.func.sum(spent), 0)).scalar()
+        page_orders = orders.filter(Order.created_at <= records[0].created_at) \
+            .order_by(Order.created_at.desc()).all()
+    
+    next_order = 0
+    for record in records:
+        while next_order < len(page_orders) and page_orders[next_order][0] > record.created_at:
+            balance += page_orders[next_order][1]
+            next_order += 1
+        record.balance_after = balance
+        balance -= record.points_change
+    
+    return records, next_cursor
+
+def history_totals(user_id):
+    row = db.session.query(
+        db.func.count(PointsHistory.id),
+        db.func.coalesce(db.func.sum(case((PointsHistory.points_change > 0, PointsHistory.points_change), else_=0)), 0),
+        db.func.coalesce(db.func.sum(case((PointsHistory.points_change < 0, PointsHistory.points_change), else_=0)), 0)
+    ).filter(PointsHistory.user_id == user_id).one()
+    
+    return {'count': row[0], 'earned': row[1], 'spent': row[2]}
+
+# Начисления и списания ученика по неделям или месяцам, новые периоды первыми.
+# Неделя обозначается датой своего понедельника.
+def points_rollup(user_id, period='month', limit=6):
+    created_at = PointsHistory.created_at
+    if db.engine.dialect.name == 'postgresql':
+        if period == 'week':
+            bucket = db.func.to_char(db.func.date_trunc('week', created_at), 'YYYY-MM-DD')
+        else:
+            bucket = db.func.to_char(created_at, 'YYYY-MM')
+    else:
+        if period == 'week':
+            bucket = db.func.date(created_at, 'weekday 0', '-6 days')
+        else:
+            bucket = db.func.strftime('%Y-%m', created_at)
+    
+    rows = db.session.query(
+        bucket.label('period'),
+        db.func.coalesce(db.func.sum(case((PointsHistory.points_change > 0, PointsHistory.points_change), else_=0)), 0),
+        db.func.coalesce(db.func.sum(case((PointsHistory.points_change < 0, PointsHistory.points_change), else_=0)), 0)
+    ).filter(PointsHistory.user_id == user_id) \
+        .group_by('period').order_by(db.desc('period')).limit(limit).all()
+    
+    return [{'period': period_label, 'earned': earned, 'spent': spent} for period_label, earned, spent in rows]
+
+# Дописывает в снимки итоги записей, появившихся после прошлого снимка
+def snapshot_points_balances():
+    tail = db.session.query(
+        PointsHistory.user_id,
+        db.func.max(PointsHistory.id),
+        db.func.sum(PointsHistory.points_change),
+        db.func.sum(case((PointsHistory.points_change > 0, PointsHistory.points_change), else_=0))
+    ).outerjoin(PointsSnapshot, PointsSnapshot.user_id == PointsHistory.user_id) \
+        .filter(PointsHistory.id > db.func.coalesce(PointsSnapshot.last_history_id, 0)) \
+        .group_by(PointsHistory.user_id).all()
+    
+    snapshots = {snapshot.user_id: snapshot for snapshot in PointsSnapshot.query.all()}
+    for user_id, last_history_id, balance, earned in tail:
+        snapshot = snapshots.get(user_id)
+        if not snapshot:
+            snapshot = PointsSnapshot(user_id=user_id, last_history_id=0, balance=0, earned=0)
+            db.session.add(snapshot)
+        snapshot.last_history_id = last_history_id
+        snapshot.balance += balance
+        snapshot.earned += earned
+    
+    db.session.commit()
+    return len(tail)
+
+# Итоги журнала по каждому ученику: снимок плюс записи после него
+def ledger_totals():
+    tail = db.session.query(
+        PointsHistory.user_id.label('user_id'),
+        db.func.sum(PointsHistory.points_change).label('balance'),
+        db.func.sum(case((PointsHistory.points_change > 0, PointsHistory.points_change), else_=0)).label('earned')
+    ).outerjoin(PointsSnapshot, PointsSnapshot.user_id == PointsHistory.user_id) \
+        .filter(PointsHistory.id > db.func.coalesce(PointsSnapshot.last_history_id, 0)) \
+        .group_by(PointsHistory.user_id).subquery()
+    
+    rows = db.session.query(
+        User.id,
+        db.func.coalesce(PointsSnapshot.balance, 0) + db.func.coalesce(tail.c.balance, 0),
+        db.func.coalesce(PointsSnapshot.earned, 0) + db.func.coalesce(tail.c.earned, 0)
+    ).outerjoin(PointsSnapshot, PointsSnapshot.user_id == User.id) \
+        .outerjoin(tail, tail.c.user_id == User.id) \
+        .filter(User.role == 'student').all()
+    
+    return {user_id: (balance, earned) for user_id, balance, earned in rows}
+
+# ========== ПАРОЛИ И ВХОД ==========
+# Метод хэширования задается целиком, вместе с параметрами (например
+# pbkdf2:sha256:600000 или scrypt:32768:8:1). Пароль со старым методом
+# перехэшируется при следующем успешном входе.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+
+# Ограничение попыток входа: ведра токенов в памяти процесса. Попытка с IP
+# тратит токен всегда, неудачная попытка тратит еще и токен логина. Без токенов
+# вход отклоняется до проверки пароля, поэтому перебор не нагружает воркер.
+# Ученики класса обычно заходят с одного IP, поэтому лимит на IP щедрый.
+app.config['LOGIN_RATE_LIMIT'] = os.environ.get('LOGIN_RATE_LIMIT', '1') == '1'
+LOGIN_IP_BUCKET = (60, 1.0)            # емкость, токенов в секунду
+LOGIN_USERNAME_BUCKET = (5, 1 / 60)
+LOGIN_BUCKETS_MAX = 10000
+
+# За обратным прокси (Railway) адрес клиента берется из X-Forwarded-For.
+# Без TRUSTED_PROXIES у всех запросов адрес прокси, и одно ведро на IP
+# ограничивало бы всю школу сразу, поэтому лимит на IP тогда не действует.
+# Procfile задает TRUSTED_PROXIES=1 для Railway.
+trusted_proxies = int(os.environ.get('TRUSTED_PROXIES', '0'))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+
+_login_buckets = OrderedDict()
+_login_buckets_lock = threading.Lock()
+
+def hash_password(password):
+    return generate_password_hash(password, method=app.config['PASSWORD_HASH_METHOD'])
+
+def password_needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != app.config['PASSWORD_HASH_METHOD']
+
+def refill_login_bucket(key, bucket, now):
+    capacity, rate = bucket
+    tokens, updated = _login_buckets.get(key, (capacity, now))
+    return min(capacity, tokens + (now - updated) * rate)
+
+# Возвращает 0, если попытку можно проверять, иначе через сколько секунд повторить
+def login_retry_after(ip, username):
+    if not app.config['LOGIN_RATE_LIMIT']:
+        return 0
+    
+    now = time.monotonic()
+    with _login_buckets_lock:
+        ip_tokens = refill_login_bucket(('ip', ip), LOGIN_IP_BUCKET, now) if trusted_proxies else 1
+        username_tokens = refill_login_bucket(('username', username), LOGIN_USERNAME_BUCKET, now)
+        if ip_tokens < 1 or username_tokens < 1:
+            waits = [(1 - tokens) / bucket[1] for tokens, bucket in 
+                     ((ip_tokens, LOGIN_IP_BUCKET), (username_tokens, LOGIN_USERNAME_BUCKET)) 
+                     if tokens < 1]
+            return max(1, int(max(waits)) + 1)
+        
+        if trusted_proxies:
+            _login_buckets[('ip', ip)] = (ip_tokens - 1, now)
+            _login_buckets.move_to_end(('ip', ip))
+        while len(_login_buckets) > LOGIN_BUCKETS_MAX:
+            _login_buckets.popitem(last=False)
+    return 0
+
+def record_login_result(username, success):
+    if not app.config['LOGIN_RATE_LIMIT']:
+        return
+    
+    key = ('username', username)
+    with _login_buckets_lock:
+        if success:
+            _login_buckets.pop(key, None)
+            return
+        
+        now = time.monotonic()
+        _login_buckets[key] = (refill_login_bucket(key, LOGIN_USERNAME_BUCKET, now) - 1, now)
+        _login_buckets.move_to_end(key)
+        while len(_login_buckets) > LOGIN_BUCKETS_MAX:
+            _login_buckets.popitem(last=False)
+
+# ========== МИГРАЦИИ ==========
+# Новая база создается через db.create_all() сразу со всеми таблицами и
+# индексами моделей, но в уже существующую базу create_all индексы не
+# добавляет. Поэтому новые таблицы и индексы перечислены здесь по версиям,
+# а примененные версии записываются в schema_migration. На PostgreSQL индекс
+# строится CONCURRENTLY, не блокируя запись в таблицу; такой запрос нельзя
+# выполнять внутри транзакции. Шаг миграции — имя таблицы, индекса или
+# колонки в виде таблица.колонка.
+MIGRATIONS = [
+    (1, 'Индексы фильтров и рейтинга пользователей',
+     ['ix_user_role', 'ix_user_group_id', 'ix_user_last_name', 'ix_user_group_role_earned_points']),
+    (2, 'Индекс истории баллов по ученику и дате', ['ix_points_history_user_created_at']),
+    (3, 'Индексы заказов по статусу, дате и ученику', ['ix_order_status_created_at', 'ix_order_student_id']),
+    (4, 'Таблицы снимков баланса, шины инвалидации и миграций',
+     ['points_snapshot', 'cache_invalidation', 'schema_migration']),
+    (5, 'Цена покупки в заказе', ['order.price']),
+]
+
+def model_index(name):
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(name)
+
+def migration_indexes():
+    return [name for _, _, names in MIGRATIONS for name in names 
+            if name not in db.metadata.tables and '.' not in name]
+
+# Колонка добавляется пустой (nullable), поэтому ALTER не переписывает таблицу
+def add_column_online(table_name, column_name):
+    engine = db.engine
+    if column_name in {column['name'] for column in inspect(engine).get_columns(table_name)}:
+        return
+    column = db.metadata.tables[table_name].c[column_name]
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            f'ALTER TABLE {preparer.format_table(column.table)} '
+            f'ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=engine.dialect)}'
+        )
+
+def create_index_online(index):
+    engine = db.engine
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+    
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if engine.dialect.name == 'postgresql':
+            # Прерванная сборка CONCURRENTLY оставляет невалидный индекс,
+            # который IF NOT EXISTS посчитал бы готовым
+            invalid = connection.execute(text(
+                'SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid '
+                'WHERE c.relname = :name AND NOT i.indisvalid'
+            ), {'name': index.name}).first()
+            if invalid:
+                connection.exec_driver_sql(f'DROP INDEX CONCURRENTLY {index.name}')
+            ddl = ddl.replace('INDEX', 'INDEX CONCURRENTLY', 1)
+        connection.exec_driver_sql(ddl)
+
+def applied_migrations():
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    return {version for version, in db.session.query(SchemaMigration.version).all()}
+
+def upgrade_database():
+    applied = applied_migrations()
+    db.session.commit()
+    
+    upgraded = []
+    for version, description, names in MIGRATIONS:
+        if version in applied:
+            continue
+        for name in names:
+            if name in db.metadata.tables:
+                db.metadata.tables[name].create(db.engine, checkfirst=True)
+            elif '.' in name:
+                add_column_online(*name.split('.'))
+            else:
+                create_index_online(model_index(name))
+        db.session.add(SchemaMigration(version=version, description=description))
+        db.session.commit()
+        upgraded.append((version, description))
+    return upgraded
 
 # Создаем администратора по умолчанию
 def create_default_admin():
@@ -166,7 +1106,7 @@ def create_default_admin():
         if not admin_exists:
             admin = User(
                 username='admin',
-                password=generate_password_hash('admin123'),
+                password=hash_password('admin123'),
                 first_name='Администратор',
                 last_name='Алгоритмики',
                 role='admin',
@@ -205,7 +1145,7 @@ def create_test_data():
         if not teacher:
             teacher = User(
                 username='teacher',
-                password=generate_password_hash('teacher123'),
+                password=hash_password('teacher123'),
                 first_name='Иван',
                 last_name='Преподавателев',
                 role='teacher',
@@ -220,7 +1160,7 @@ def create_test_data():
         if not student1:
             student1 = User(
                 username='student1',
-                password=generate_password_hash('student123'),
+                password=hash_password('student123'),
                 first_name='Алексей',
                 last_name='Учеников',
                 role='student',
@@ -232,7 +1172,7 @@ def create_test_data():
             
             student2 = User(
                 username='student2',
-                password=generate_password_hash('student123'),
+                password=hash_password('student123'),
                 first_name='Мария',
                 last_name='Ученикова',
                 role='student',
@@ -333,12 +1273,18 @@ def create_test_data():
             db.session.commit()
             print("✅ Созданы советы для учеников")
 
-# Создаем БД и тестовые данные при запуске
-with app.app_context():
-    db.create_all()
-    create_default_admin()
-    create_default_groups()
-    create_test_data()
+# Создаем БД и тестовые данные. Запускается один раз перед стартом воркеров
+# (flask init-db), чтобы воркеры не ходили в базу при загрузке и не
+# соревновались друг с другом, создавая одни и те же строки
+def init_database(test_data=True):
+    with app.app_context():
+        db.create_all()
+        for version, description in upgrade_database():
+            print(f"✅ Миграция {version}: {description}")
+        create_default_admin()
+        create_default_groups()
+        if test_data:
+            create_test_data()
     print("✅ База данных и тестовые данные созданы")
 
 # Главная страница
@@ -368,9 +1314,18 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
+        retry_after = login_retry_after(request.remote_addr, username)
+        if retry_after:
+            flash(f'Слишком много попыток входа, попробуйте через {retry_after} с', 'error')
+            return render_template('login.html'), 429, {'Retry-After': str(retry_after)}
+        
         user = User.query.filter_by(username=username).first()
         
         if user and check_password_hash(user.password, password):
+            record_login_result(username, True)
+            if password_needs_rehash(user.password):
+                user.password = hash_password(password)
+                db.session.commit()
             login_user(user)
             
             if user.role == 'admin':
@@ -380,6 +1335,7 @@ def login():
             else:
                 return redirect(url_for('student_dashboard'))
         
+        record_login_result(username, False)
         flash('Неверный логин или пароль', 'error')
     
     return render_template('login.html')
@@ -392,21 +1348,122 @@ def logout():
 
 # ========== АДМИНИСТРАТОР ==========
 
+DASHBOARD_CACHE_TTL = 5
+
+# Все счетчики панели администратора одним запросом
+def admin_dashboard_stats():
+    products_count = db.session.query(db.func.count(Product.id)).scalar_subquery()
+    pending_orders_count = db.session.query(db.func.count(Order.id)) \
+        .filter(Order.status == 'pending').scalar_subquery()
+    
+    row = db.session.query(
+        db.func.count(User.id),
+        db.func.count(case((User.role == 'student', User.id))),
+        db.func.count(case((User.role == 'teacher', User.id))),
+        products_count,
+        pending_orders_count
+    ).one()
+    
+    return {
+        'total_users': row[0],
+        'total_students': row[1],
+        'total_teachers': row[2],
+        'total_products': row[3],
+        'pending_orders': row[4]
+    }
+
 @app.route('/admin')
 @login_required
 def admin_dashboard():
     if current_user.role != 'admin':
         return redirect(url_for('index'))
     
-    stats = {
-        'total_users': User.query.count(),
-        'total_students': User.query.filter_by(role='student').count(),
-        'total_teachers': User.query.filter_by(role='teacher').count(),
-        'total_products': Product.query.count(),
-        'pending_orders': Order.query.filter_by(status='pending').count()
-    }
+    stats = cached('admin_dashboard', DASHBOARD_CACHE_TTL, admin_dashboard_stats, 
+                   tables={'user', 'product', 'order'})
+    
+    groups = db.session.query(Group.id, Group.name).order_by(Group.name).all()
     
-    return render_template('admin/dashboard.html', stats=stats)
+    return render_template('admin/dashboard.html', stats=stats, groups=groups)
+
+@app.route('/admin/perf', methods=['GET', 'POST'])
+@login_required
+def admin_perf():
+    if current_user.role != 'admin':
+        return redirect(url_for('index'))
+    
+    if request.method == 'POST':
+        with _sql_profile_lock:
+            _sql_profile.clear()
+        flash('Статистика запросов сброшена', 'success')
+        return redirect(url_for('admin_perf'))
+    
+    return render_template('admin/perf.html', rows=sql_profile_report(), 
+                           enabled=app.config['SQL_PROFILE'], 
+                           repeat_threshold=SQL_REPEAT_THRESHOLD,
+                           pool=pool_status())
+
+@app.route('/api/admin/pool')
+@login_required
+def api_admin_pool():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    return jsonify(pool_status())
+
+# Курсор для keyset-пагинации: "значение|id" последней строки предыдущей страницы
+def make_cursor(value, row_id):
+    return f'{value}|{row_id}'
+
+def parse_cursor(cursor):
+    if not cursor:
+        return None
+    value, _, row_id = cursor.rpartition('|')
+    if not row_id.isdigit():
+        return None
+    return value, int(row_id)
+
+USERS_PER_PAGE = 50
+USER_ROLES = ('admin', 'teacher', 'student')
+
+# Страница списка пользователей с фильтрами по роли, группе и началу
+# имени/фамилии/логина; сортировка по (last_name, id) для keyset-пагинации
+def users_page(args):
+    query = User.query.options(joinedload(User.group))
+    
+    role = args.get('role')
+    if role in USER_ROLES:
+        query = query.filter(User.role == role)
+    
+    group_id = args.get('group_id', '')
+    if group_id == 'none':
+        query = query.filter(User.group_id.is_(None))
+    elif group_id.isdigit():
+        query = query.filter(User.group_id == int(group_id))
+    
+    search = args.get('q', '').strip()
+    if search:
+        query = query.filter(or_(
+            User.last_name.startswith(search, autoescape=True),
+            User.first_name.startswith(search, autoescape=True),
+            User.username.startswith(search, autoescape=True)
+        ))
+    
+    cursor = parse_cursor(args.get('cursor'))
+    if cursor:
+        cursor_last_name, cursor_id = cursor
+        query = query.filter(or_(
+            User.last_name > cursor_last_name,
+            and_(User.last_name == cursor_last_name, User.id > cursor_id)
+        ))
+    
+    users = query.order_by(User.last_name, User.id).limit(USERS_PER_PAGE + 1).all()
+    
+    next_cursor = None
+    if len(users) > USERS_PER_PAGE:
+        users = users[:USERS_PER_PAGE]
+        next_cursor = make_cursor(users[-1].last_name, users[-1].id)
+    
+    return users, next_cursor
 
 @app.route('/admin/users')
 @login_required
@@ -414,9 +1471,230 @@ def admin_users():
     if current_user.role != 'admin':
         return redirect(url_for('index'))
     
-    users = User.query.all()
-    groups = Group.query.all()
-    return render_template('admin/users.html', users=users, groups=groups)
+    users, next_cursor = users_page(request.args)
+    groups = Group.query.order_by(Group.name).all()
+    return render_template('admin/users.html', 
+                         users=users, 
+                         groups=groups, 
+                         next_cursor=next_cursor, 
+                         filters=request.args)
+
+@app.route('/api/admin/users')
+@login_required
+def api_admin_users():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    users, next_cursor = users_page(request.args)
+    
+    result = []
+    for user in users:
+        result.append({
+            'id': user.id,
+            'username': user.username,
+            'name': f'{user.first_name} {user.last_name}',
+            'role': user.role,
+            'group': user.group.name if user.group else None,
+            'points': user.points,
+            'url': url_for('user_detail', user_id=user.id)
+        })
+    
+    return jsonify({'users': result, 'next_cursor': next_cursor})
+
+IMPORT_BATCH_SIZE = 500
+IMPORT_POOL_THRESHOLD = 50
+# Через веб-форму пароли хешируются прямо в запросе (около 0,2 с на пароль),
+# поэтому импорт должен уложиться в timeout gunicorn. Большие файлы
+# загружаются командой flask users import.
+IMPORT_WEB_MAX_ROWS = 100
+IMPORT_REQUIRED_FIELDS = ('username', 'password', 'first_name', 'last_name', 'role')
+
+# Хеширование паролей намеренно медленное, поэтому большие пачки
+# хешируются параллельно в пуле процессов
+def hash_passwords(passwords, get_pool):
+    if len(passwords) < IMPORT_POOL_THRESHOLD:
+        return [hash_password(password) for password in passwords]
+    
+    # В процессах пула конфигурации приложения нет, поэтому метод передается явно
+    hash_with_policy = partial(generate_password_hash, method=app.config['PASSWORD_HASH_METHOD'])
+    chunksize = max(1, len(passwords) // ((os.cpu_count() or 1) * 4))
+    return list(get_pool().map(hash_with_policy, passwords, chunksize=chunksize))
+
+# Построчное чтение CSV: первая строка — заголовки (username, password,
+# first_name, last_name, role, group), разделитель определяется автоматически
+def read_users_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    header = text.readline()
+    try:
+        dialect = csv.Sniffer().sniff(header, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    
+    reader = csv.DictReader(itertools.chain([header], text), dialect=dialect)
+    for row in reader:
+        yield reader.line_num, {
+            key.strip().lower(): value or ''
+            for key, value in row.items() if key
+        }
+
+# Создание пользователей пачками: логины сверяются с БД одним запросом на
+# пачку, пароли хешируются в пуле процессов, строки вставляются одним
+# executemany. Возвращает отчет по каждой строке. Коммит делает вызывающий код.
+def import_users(rows, dry_run=False):
+    groups_by_name = {}
+    group_ids = set()
+    for group_id, name in db.session.query(Group.id, Group.name).all():
+        groups_by_name[name.strip().lower()] = group_id
+        group_ids.add(group_id)
+    
+    report = []
+    seen_usernames = set()
+    batch = []
+    
+    # Один пул на весь импорт, создается при первой большой пачке. Процессы
+    # запускаются через spawn: fork из воркера gthread скопировал бы
+    # блокировки, захваченные другими потоками.
+    pool = None
+    
+    def get_pool():
+        nonlocal pool
+        if pool is None:
+            pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+        return pool
+    
+    def flush(batch):
+        usernames = [row['username'] for _, row, _ in batch]
+        existing = {
+            username for (username,) in 
+            db.session.query(User.username).filter(User.username.in_(usernames)).all()
+        }
+        
+        new_rows = []
+        for line, row, entry in batch:
+            if row['username'] in existing:
+                entry.update(status='exists', message='Пользователь с таким логином уже существует')
+            else:
+                new_rows.append((row, entry))
+        
+        if not dry_run and new_rows:
+            hashes = hash_passwords([row['password'] for row, _ in new_rows], get_pool)
+            db.session.execute(
+                User.__table__.insert().execution_options(changed_user_ids=set()),
+                [
+                    {
+                        'username': row['username'],
+                        'password': password_hash,
+                        'visible_password': row['password'],
+                        'first_name': row['first_name'],
+                        'last_name': row['last_name'],
+                        'role': row['role'],
+                        'group_id': row['group_id'],
+                        'points': 0,
+                        'earned_points': 0
+                    }
+                    for (row, _), password_hash in zip(new_rows, hashes)
+                ]
+            )
+        
+        for _, entry in new_rows:
+            entry.update(status='ok' if dry_run else 'created', message='')
+    
+    try:
+        for line, raw in rows:
+            row = {key: (value if key == 'password' else value.strip()) for key, value in raw.items()}
+            entry = {'line': line, 'username': row.get('username', ''), 'status': 'invalid', 'message': ''}
+            report.append(entry)
+            
+            missing = [field for field in IMPORT_REQUIRED_FIELDS if not row.get(field)]
+            group = row.get('group', '')
+            if missing:
+                entry['message'] = 'Не заполнены поля: ' + ', '.join(missing)
+                continue
+            if row['role'] not in USER_ROLES:
+                entry['message'] = f'Неизвестная роль: {row["role"]}'
+                continue
+            
+            if not group:
+                row['group_id'] = None
+            elif group.isdigit() and int(group) in group_ids:
+                row['group_id'] = int(group)
+            elif group.lower() in groups_by_name:
+                row['group_id'] = groups_by_name[group.lower()]
+            else:
+                entry['message'] = f'Группа не найдена: {group}'
+                continue
+            
+            if row['username'] in seen_usernames:
+                entry.update(status='duplicate', message='Логин повторяется в файле')
+                continue
+            seen_usernames.add(row['username'])
+            
+            batch.append((line, row, entry))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        
+        if batch:
+            flush(batch)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    
+    return report
+
+@app.route('/admin/users/import', methods=['POST'])
+@login_required
+def import_users_csv():
+    if current_user.role != 'admin':
+        return redirect(url_for('index'))
+    
+    groups = Group.query.order_by(Group.name).all()
+    upload = request.files.get('users_file')
+    dry_run = 'dry_run' in request.form
+    
+    if not upload or not upload.filename:
+        flash('Выберите CSV-файл для импорта', 'error')
+        return render_template('admin/create_users.html', groups=groups)
+    
+    try:
+        started = time.perf_counter()
+        rows = read_users_csv(upload.stream)
+        if not dry_run:
+            rows = list(itertools.islice(rows, IMPORT_WEB_MAX_ROWS + 1))
+            if len(rows) > IMPORT_WEB_MAX_ROWS:
+                flash(f'Через форму можно импортировать не больше {IMPORT_WEB_MAX_ROWS} строк. '
+                      f'Большой файл загрузите командой flask users import', 'error')
+                return render_template('admin/create_users.html', groups=groups)
+        report = import_users(rows, dry_run=dry_run)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        elapsed = time.perf_counter() - started
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        flash(f'Не удалось прочитать файл: {str(e)}', 'error')
+        return render_template('admin/create_users.html', groups=groups)
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Ошибка при импорте пользователей: {str(e)}', 'error')
+        return render_template('admin/create_users.html', groups=groups)
+    
+    summary = {}
+    for row in report:
+        summary[row['status']] = summary.get(row['status'], 0) + 1
+    
+    if dry_run:
+        flash(f'Проверка завершена: можно создать {summary.get("ok", 0)} из {len(report)} пользователей', 'info')
+    else:
+        flash(f'Импорт завершен: создано {summary.get("created", 0)} из {len(report)} пользователей '
+              f'за {elapsed:.1f} с', 'success')
+    
+    return render_template('admin/create_users.html', 
+                         groups=groups, 
+                         import_report=[row for row in report if row['status'] not in ('ok', 'created')], 
+                         import_summary=summary, 
+                         dry_run=dry_run)
 
 @app.route('/admin/users/create', methods=['GET', 'POST'])
 @login_required
@@ -425,40 +1703,28 @@ def create_users():
         return redirect(url_for('index'))
     
     if request.method == 'POST':
+        rows = []
+        for i in range(1, 11):
+            username = request.form.get(f'username_{i}')
+            if username and username.strip():
+                rows.append((i, {
+                    'username': username,
+                    'password': request.form.get(f'password_{i}', ''),
+                    'first_name': request.form.get(f'first_name_{i}', ''),
+                    'last_name': request.form.get(f'last_name_{i}', ''),
+                    'role': request.form.get(f'role_{i}', ''),
+                    'group': request.form.get(f'group_id_{i}', '')
+                }))
+        
         try:
-            users_created = 0
-            
-            for i in range(1, 11):
-                username = request.form.get(f'username_{i}')
-                if username and username.strip():
-                    password = request.form.get(f'password_{i}')
-                    first_name = request.form.get(f'first_name_{i}')
-                    last_name = request.form.get(f'last_name_{i}')
-                    role = request.form.get(f'role_{i}')
-                    group_id = request.form.get(f'group_id_{i}')
-                    
-                    if password and first_name and last_name and role:
-                        existing_user = User.query.filter_by(username=username.strip()).first()
-                        if existing_user:
-                            flash(f'Пользователь с логином {username} уже существует', 'warning')
-                            continue
-                        
-                        user = User(
-                            username=username.strip(),
-                            password=generate_password_hash(password),
-                            visible_password=password,
-                            first_name=first_name.strip(),
-                            last_name=last_name.strip(),
-                            role=role,
-                            group_id=int(group_id) if group_id else None,
-                            points=0,
-                            earned_points=0
-                        )
-                        db.session.add(user)
-                        users_created += 1
-            
+            report = import_users(rows)
             db.session.commit()
             
+            for row in report:
+                if row['status'] != 'created':
+                    flash(f'Строка {row["line"]} ({row["username"]}): {row["message"]}', 'warning')
+            
+            users_created = sum(1 for row in report if row['status'] == 'created')
             if users_created > 0:
                 flash(f'Успешно создано {users_created} пользователей', 'success')
             else:
@@ -498,7 +1764,7 @@ def user_detail(user_id):
             new_password = request.form.get('new_password', '')
             if new_password:
                 user.visible_password = new_password
-                user.password = generate_password_hash(new_password)
+                user.password = hash_password(new_password)
             
             if current_user.role == 'admin':
                 user.role = request.form['role']
@@ -548,6 +1814,7 @@ def user_detail(user_id):
         elif 'delete_user' in request.form and current_user.role == 'admin':
             try:
                 PointsHistory.query.filter_by(user_id=user.id).delete()
+                PointsSnapshot.query.filter_by(user_id=user.id).delete()
                 Order.query.filter_by(student_id=user.id).delete()
                 
                 if user.role == 'teacher':
@@ -565,16 +1832,20 @@ def user_detail(user_id):
                 db.session.rollback()
                 flash(f'Ошибка при удалении пользователя: {str(e)}', 'error')
     
-    history = PointsHistory.query.filter_by(user_id=user.id).order_by(PointsHistory.created_at.desc()).all()
+    history, next_history_cursor = history_page(user, request.args.get('history_cursor'))
     groups = Group.query.all()
-    reward_reasons = RewardReason.query.order_by(RewardReason.order).all()
     
     if current_user.role == 'admin':
         template = 'admin/user_detail.html'
     else:
         template = 'teacher/student_detail.html'
     
-    return render_template(template, user=user, groups=groups, history=history, reward_reasons=reward_reasons)
+    return render_template(template, 
+                         user=user, 
+                         groups=groups, 
+                         history=history, 
+                         next_history_cursor=next_history_cursor, 
+                         reward_reasons=reward_reasons())
 
 @app.route('/admin/users/delete/<int:user_id>', methods=['POST'])
 @login_required
@@ -590,6 +1861,7 @@ def delete_user(user_id):
     
     try:
         PointsHistory.query.filter_by(user_id=user.id).delete()
+        PointsSnapshot.query.filter_by(user_id=user.id).delete()
         Order.query.filter_by(student_id=user.id).delete()
         
         if user.role == 'teacher':
@@ -614,7 +1886,7 @@ def admin_groups():
     if current_user.role != 'admin':
         return redirect(url_for('index'))
     
-    groups = Group.query.all()
+    groups = groups_with_student_counts()
     teachers = User.query.filter_by(role='teacher').all()
     return render_template('admin/groups.html', groups=groups, teachers=teachers)
 
@@ -667,10 +1939,7 @@ def group_detail(group_id):
                 db.session.rollback()
                 flash(f'Ошибка при удалении группы: {str(e)}', 'error')
     
-    students = User.query.filter_by(group_id=group_id, role='student').order_by(User.earned_points.desc()).all()
-    
-    for i, student in enumerate(students, 1):
-        student.rating_position = i
+    students = group_leaderboard(group_id)
     
     return render_template('admin/group_detail.html', group=group, teachers=teachers, students=students)
 
@@ -695,15 +1964,264 @@ def delete_group(group_id):
     
     return redirect(url_for('admin_groups'))
 
+# ========== СТАТИКА ==========
+# Стили и скрипты лежат в static/css и static/js, у страниц — в подпапках по
+# разделам (css/student/shop.css). Команда flask assets build минифицирует их и
+# кладет в static/dist под именами с хешем содержимого, рядом — сжатые .gz и .br,
+# а в manifest.json — соответствие исходного пути собранному. Собранный файл
+# никогда не меняется, поэтому отдается с вечным кэшем: после правки у него
+# просто другое имя. Без сборки и в режиме отладки шаблоны ссылаются на исходники.
+ASSET_SOURCES = ('css', 'js')
+ASSET_FOLDER = 'dist'
+ASSET_HASH_LENGTH = 12
+ASSET_ENCODINGS = {'br': '.br', 'gzip': '.gz'}     # в порядке предпочтения
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_asset_state = {'manifest': None}
+
+CSS_PROTECTED = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/)', re.S)
+
+def minify_css(text):
+    parts = CSS_PROTECTED.split(text)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r'\s+', ' ', parts[i])
+        part = re.sub(r' ?([{};,>]) ?', r'\1', part)
+        parts[i] = part.replace(': ', ':').replace(';}', '}')
+    # Строки оставляем как есть, комментарии выбрасываем
+    return ''.join(part for i, part in enumerate(parts) 
+                   if i % 2 == 0 or not part.startswith('/*')).strip()
+
+# Скрипты сжимаются построчно: убираются отступы, пустые строки и комментарии
+# в начале строки (код после */ остается). Переводы строк остаются, поэтому
+# автоматическая расстановка точек с запятой работает как в исходнике.
+# Многострочные шаблонные строки не трогаем.
+def minify_js(text):
+    lines = []
+    in_template = in_comment = False
+    for line in text.splitlines():
+        if in_template:
+            code = line
+            lines.append(line)
+        else:
+            code = line.lstrip()
+            if in_comment:
+                if '*/' not in code:
+                    continue
+                code = code.split('*/', 1)[1].lstrip()
+                in_comment = False
+            while code.startswith('/*'):
+                if '*/' not in code[2:]:
+                    in_comment = True
+                    break
+                code = code[2:].split('*/', 1)[1].lstrip()
+            if in_comment or not code.strip() or code.startswith('//'):
+                continue
+            lines.append(code.strip())
+        
+        if (code.count('`') - code.count('\\`')) % 2:
+            in_template = not in_template
+            if in_template:
+                # Хвостовые пробелы уже внутри шаблонной строки
+                lines[-1] = code
+    return '\n'.join(lines) + '\n'
+
+ASSET_MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+def compress_asset(data):
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    # Сжатый вариант, который не меньше исходника, отдавать незачем
+    return {encoding: compressed for encoding, compressed in variants.items() if len(compressed) < len(data)}
+
+def iter_asset_sources():
+    for source_folder in ASSET_SOURCES:
+        for root, _, files in os.walk(os.path.join(app.static_folder, source_folder)):
+            for name in files:
+                if os.path.splitext(name)[1] in ASSET_MINIFIERS:
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, app.static_folder).replace(os.sep, '/')
+
+# Старые файлы не удаляются, пока не передан clean: воркеры, еще не
+# перечитавшие манифест, продолжают ссылаться на прежние имена
+def build_assets(clean=False):
+    folder = os.path.join(app.static_folder, ASSET_FOLDER)
+    manifest = {}
+    stats = []
+    if brotli is None:
+        app.logger.warning('Пакет brotli не установлен, файлы .br не создаются')
+    
+    for source in sorted(iter_asset_sources()):
+        stem, ext = os.path.splitext(source)
+        with open(os.path.join(app.static_folder, source), encoding='utf-8') as f:
+            original = f.read()
+        data = ASSET_MINIFIERS[ext](original).encode('utf-8')
+        built = f'{stem}.{hashlib.sha256(data).hexdigest()[:ASSET_HASH_LENGTH]}{ext}'
+        
+        variants = compress_asset(data)
+        path = os.path.join(folder, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for suffix, content in [('', data)] + [(ASSET_ENCODINGS[encoding], compressed) 
+                                               for encoding, compressed in variants.items()]:
+            with open(path + suffix, 'wb') as f:
+                f.write(content)
+        
+        manifest[source] = built
+        stats.append({
+            'source': source, 
+            'built': built,
+            'original': len(original.encode('utf-8')), 
+            'minified': len(data),
+            **{encoding: len(compressed) for encoding, compressed in variants.items()},
+        })
+    
+    temp_path = os.path.join(folder, f'manifest.json.{os.getpid()}.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, os.path.join(folder, 'manifest.json'))
+    _asset_state['manifest'] = manifest
+    
+    if clean:
+        keep = {name + suffix for name in manifest.values() for suffix in ('', *ASSET_ENCODINGS.values())}
+        keep.add('manifest.json')
+        for root, _, files in os.walk(folder):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, folder).replace(os.sep, '/') not in keep:
+                    os.remove(path)
+    
+    return stats
+
+def asset_manifest():
+    if _asset_state['manifest'] is None:
+        try:
+            with open(os.path.join(app.static_folder, ASSET_FOLDER, 'manifest.json'), encoding='utf-8') as f:
+                _asset_state['manifest'] = json.load(f)
+        except FileNotFoundError:
+            _asset_state['manifest'] = {}
+    return _asset_state['manifest']
+
+@app.template_global()
+def asset_url(path):
+    built = None if app.debug else asset_manifest().get(path)
+    if built:
+        return url_for('built_asset', filename=built)
+    return url_for('static', filename=path)
+
+# Собранные файлы отдаются в заранее сжатом виде, если клиент его принимает.
+# Отдается любой файл из каталога сборки, а не только из текущего манифеста:
+# страницы, открытые до деплоя, ссылаются на файлы прежней сборки.
+@app.route(f'/static/{ASSET_FOLDER}/<path:filename>')
+def built_asset(filename):
+    folder = os.path.join(app.static_folder, ASSET_FOLDER)
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in ASSET_ENCODINGS.items():
+        if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+            response = send_from_directory(folder, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(folder, filename, mimetype=mimetype)
+    
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = ASSET_CACHE_CONTROL
+    return response
+
+# ========== ИЗОБРАЖЕНИЯ ТОВАРОВ ==========
+# Загруженное изображение сохраняется в нескольких размерах в WebP. Имя файла —
+# хеш содержимого, поэтому одинаковые картинки не дублируются, а файлы можно
+# кэшировать в браузере навсегда. В Product.image хранится путь без размера
+# относительно static: images/products/<хеш>.
+PRODUCT_IMAGE_PREFIX = 'images/products'
+PRODUCT_IMAGE_SIZES = {'thumb': 160, 'card': 480, 'full': 1200}
+PRODUCT_IMAGE_QUALITY = 82
+PRODUCT_IMAGE_NAME = re.compile(r'^[0-9a-f]{20}-(?:' + '|'.join(PRODUCT_IMAGE_SIZES) + r')\.webp$')
+
+# Вызывается и в пуле процессов, поэтому не трогает приложение и БД
+def process_product_image(data, folder):
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    paths = {size: os.path.join(folder, f'{digest}-{size}.webp') for size in PRODUCT_IMAGE_SIZES}
+    
+    if not all(os.path.exists(path) for path in paths.values()):
+        with Image.open(io.BytesIO(data)) as source:
+            image = ImageOps.exif_transpose(source)
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        
+        os.makedirs(folder, exist_ok=True)
+        for size, path in paths.items():
+            resized = image.copy()
+            resized.thumbnail((PRODUCT_IMAGE_SIZES[size], PRODUCT_IMAGE_SIZES[size]), Image.LANCZOS)
+            # Пишем во временный файл, чтобы параллельная загрузка не увидела половину файла
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            resized.save(temp_path, 'WEBP', quality=PRODUCT_IMAGE_QUALITY, method=4)
+            os.replace(temp_path, path)
+    
+    return digest
+
+@app.template_global()
+def product_image_url(image, size='card'):
+    if not image:
+        return None
+    
+    # Старые загрузки хранились файлом как есть и с префиксом static/
+    if image.startswith('static/'):
+        image = image[len('static/'):]
+    if os.path.splitext(image)[1]:
+        return url_for('static', filename=image)
+    
+    return url_for('static', filename=f'{image}-{size}.webp')
+
+@app.after_request
+def cache_product_images(response):
+    if request.path.startswith('/static/') and response.status_code == 200 \
+            and PRODUCT_IMAGE_NAME.match(request.path.rsplit('/', 1)[-1]):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+CATALOG_CACHE_TTL = 300
+PRODUCT_FIELDS = ('id', 'name', 'description', 'image', 'price', 'original_price', 'category')
+
+# Каталог магазина меняется редко, поэтому он хранится в кэше уже разбитым
+# по категориям и сбрасывается только при создании, изменении и удалении
+# товаров. Остатки меняются при каждой покупке и читаются отдельно.
+def load_catalog():
+    products = [
+        {field: getattr(product, field) for field in PRODUCT_FIELDS}
+        for product in Product.query.order_by(Product.id).all()
+    ]
+    
+    by_category = {}
+    for product in products:
+        by_category.setdefault(product['category'], []).append(product)
+    
+    return {'products': products, 'by_category': by_category}
+
+def shop_catalog(in_stock_only=False):
+    stock = dict(db.session.query(Product.id, Product.quantity).all())
+    
+    catalog = cached('catalog', CATALOG_CACHE_TTL, load_catalog, tables={'catalog'})
+    if len(catalog['products']) != len(stock) or any(product['id'] not in stock for product in catalog['products']):
+        # Товар добавили или удалили в другом процессе
+        invalidate_tables({'catalog'})
+        catalog = cached('catalog', CATALOG_CACHE_TTL, load_catalog, tables={'catalog'})
+    
+    products = [dict(product, quantity=stock[product['id']]) for product in catalog['products']]
+    if in_stock_only:
+        products = [product for product in products if product['quantity'] > 0]
+    
+    return products, list(catalog['by_category'])
+
 @app.route('/admin/shop')
 @login_required
 def admin_shop():
     if current_user.role != 'admin':
         return redirect(url_for('index'))
     
-    products = Product.query.all()
-    categories = db.session.query(Product.category).distinct().all()
-    categories = [c[0] for c in categories]
+    products, categories = shop_catalog()
     
     return render_template('admin/shop_admin.html', products=products, categories=categories)
 
@@ -758,13 +2276,12 @@ def product_detail(product_id=None):
         image_filename = None
         
         if image_file and image_file.filename:
-            # Создаем папку для загрузок, если её нет
-            os.makedirs('static/images/products', exist_ok=True)
-            
-            filename = secure_filename(image_file.filename)
-            image_path = os.path.join('static/images/products', filename)
-            image_file.save(image_path)
-            image_filename = f'static/images/products/{filename}'
+            try:
+                digest = process_product_image(image_file.read(), app.config['UPLOAD_FOLDER'])
+                image_filename = f'{PRODUCT_IMAGE_PREFIX}/{digest}'
+            except (OSError, Image.DecompressionBombError):
+                flash('Не удалось обработать изображение. Загрузите JPG, PNG, GIF или WebP', 'error')
+                return render_template('admin/product_detail.html', product=product)
         
         if product:
             # Обновляем существующий товар
@@ -790,6 +2307,7 @@ def product_detail(product_id=None):
             db.session.add(product)
         
         try:
+            mark_tables_changed(db.session, {'catalog'})
             db.session.commit()
             
             if product_id:
@@ -805,14 +2323,107 @@ def product_detail(product_id=None):
     
     return render_template('admin/product_detail.html', product=product)
 
+ORDERS_PER_PAGE = 50
+ORDER_STATUSES = ('pending', 'completed', 'cancelled')
+
 @app.route('/admin/orders')
 @login_required
 def admin_orders():
     if current_user.role != 'admin':
         return redirect(url_for('index'))
     
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return render_template('admin/orders.html', orders=orders)
+    status = request.args.get('status', 'all')
+    if status not in ORDER_STATUSES:
+        status = 'all'
+    
+    query = Order.query.options(
+        joinedload(Order.student).joinedload(User.group),
+        joinedload(Order.product)
+    )
+    if status != 'all':
+        query = query.filter(Order.status == status)
+    
+    # Keyset-пагинация: следующая страница начинается после последнего (created_at, id)
+    cursor = parse_cursor(request.args.get('cursor'))
+    if cursor:
+        cursor_created_at, cursor_id = cursor
+        try:
+            cursor_created_at = datetime.fromisoformat(cursor_created_at)
+        except ValueError:
+            cursor = None
+        else:
+            query = query.filter(or_(
+                Order.created_at < cursor_created_at,
+                and_(Order.created_at == cursor_created_at, Order.id < cursor_id)
+            ))
+    
+    orders = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(ORDERS_PER_PAGE + 1).all()
+    
+    next_cursor = None
+    if len(orders) > ORDERS_PER_PAGE:
+        orders = orders[:ORDERS_PER_PAGE]
+        last = orders[-1]
+        next_cursor = make_cursor(last.created_at.isoformat(), last.id)
+    
+    status_counts = dict(
+        db.session.query(Order.status, db.func.count(Order.id)).group_by(Order.status).all()
+    )
+    
+    return render_template('admin/orders.html', 
+                         orders=orders, 
+                         status=status, 
+                         status_counts=status_counts, 
+                         next_cursor=next_cursor, 
+                         is_first_page=cursor is None)
+
+# Переводит ожидающие заказы в completed или cancelled одной транзакцией.
+# Статус меняется только у заказов в pending, поэтому заказ нельзя отменить
+# дважды. При отмене баллы возвращаются одним UPDATE на всех учеников, а
+# товары — одним UPDATE на все товары. Коммит делает вызывающий код.
+def fulfil_orders(order_ids, new_status):
+    pending = db.session.query(Order.id, Order.student_id, Order.product_id, Order.quantity, 
+                               ORDER_PRICE.label('price')) \
+        .join(Product, Order.product_id == Product.id) \
+        .filter(Order.id.in_(set(order_ids)), Order.status == 'pending') \
+        .with_for_update(of=Order).all()
+    if not pending:
+        return 0
+    
+    orders = Order.__table__
+    pending_ids = [row.id for row in pending]
+    moved = db.session.execute(
+        orders.update()
+        .where(orders.c.id.in_(pending_ids), orders.c.status == 'pending')
+        .values(status=new_status)
+    )
+    if moved.rowcount != len(pending_ids):
+        raise RuntimeError('Заказы изменились во время обработки, попробуйте еще раз')
+    
+    if new_status == 'cancelled':
+        refunds = {}
+        restock = {}
+        for row in pending:
+            refunds[row.student_id] = refunds.get(row.student_id, 0) + row.price * row.quantity
+            restock[row.product_id] = restock.get(row.product_id, 0) + row.quantity
+        
+        # Товар блокируется раньше ученика, как в purchase_product: при одном
+        # порядке блокировок покупка и отмена не могут ждать друг друга по кругу
+        products = Product.__table__
+        db.session.execute(
+            products.update()
+            .where(products.c.id.in_(restock.keys()))
+            .values(quantity=products.c.quantity + case(restock, value=products.c.id))
+        )
+        
+        users = User.__table__
+        db.session.execute(
+            users.update()
+            .where(users.c.id.in_(refunds.keys()))
+            .values(points=users.c.points + case(refunds, value=users.c.id))
+            .execution_options(changed_user_ids=set(refunds))
+        )
+    
+    return len(pending_ids)
 
 @app.route('/admin/orders/<int:order_id>', methods=['GET', 'POST'])
 @login_required
@@ -822,22 +2433,61 @@ def order_detail(order_id):
     
     order = Order.query.get_or_404(order_id)
     
-    if request.method == 'POST':
-        if 'complete' in request.form:
-            order.status = 'completed'
-            db.session.commit()
-            flash('Заказ отмечен как выданный', 'success')
+    if request.method == 'POST' and ('complete' in request.form or 'cancel' in request.form):
+        new_status = 'completed' if 'complete' in request.form else 'cancelled'
         
-        elif 'cancel' in request.form:
-            order.student.points += order.product.price * order.quantity
-            order.product.quantity += order.quantity
-            order.status = 'cancelled'
-            
+        try:
+            processed = fulfil_orders([order.id], new_status)
             db.session.commit()
-            flash('Заказ отменен', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Ошибка при обработке заказа: {str(e)}', 'error')
+        else:
+            if not processed:
+                flash('Заказ уже обработан', 'warning')
+            elif new_status == 'completed':
+                flash('Заказ отмечен как выданный', 'success')
+            else:
+                flash('Заказ отменен', 'success')
+        
+        order = Order.query.get_or_404(order_id)
     
     return render_template('admin/order_detail.html', order=order)
 
+@app.route('/admin/orders/batch', methods=['POST'])
+@login_required
+def batch_orders():
+    if current_user.role != 'admin':
+        return redirect(url_for('index'))
+    
+    action = request.form.get('action')
+    order_ids = [int(order_id) for order_id in request.form.getlist('order_ids') if order_id.isdigit()]
+    
+    if action not in ('complete', 'cancel') or not order_ids:
+        flash('Выберите заказы и действие', 'warning')
+        return redirect(request.referrer or url_for('admin_orders'))
+    
+    new_status = 'completed' if action == 'complete' else 'cancelled'
+    
+    try:
+        processed = fulfil_orders(order_ids, new_status)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Ошибка при обработке заказов: {str(e)}', 'error')
+        return redirect(request.referrer or url_for('admin_orders'))
+    
+    if new_status == 'completed':
+        flash(f'Выдано заказов: {processed}', 'success')
+    else:
+        flash(f'Отменено заказов: {processed}', 'success')
+    
+    skipped = len(set(order_ids)) - processed
+    if skipped:
+        flash(f'Пропущено заказов (уже обработаны): {skipped}', 'warning')
+    
+    return redirect(request.referrer or url_for('admin_orders'))
+
 @app.route('/admin/shop/product/delete/<int:product_id>', methods=['POST'])
 @login_required
 def delete_product(product_id):
@@ -846,11 +2496,27 @@ def delete_product(product_id):
     
     product = Product.query.get_or_404(product_id)
     db.session.delete(product)
+    mark_tables_changed(db.session, {'catalog'})
     db.session.commit()
     
     flash('Товар удален', 'success')
     return redirect(url_for('admin_shop'))
 
+REWARD_REASONS_CACHE_TTL = 60
+REWARD_REASON_FIELDS = ('id', 'reason', 'points', 'order')
+
+# Причины начисления нужны на каждой странице начисления баллов, а меняются
+# редко. Кэш сбрасывается коммитом, который изменил таблицу reward_reason.
+def load_reward_reasons():
+    return [
+        {field: getattr(reason, field) for field in REWARD_REASON_FIELDS}
+        for reason in RewardReason.query.order_by(RewardReason.order, RewardReason.id).all()
+    ]
+
+def reward_reasons():
+    return cached('reward_reasons', REWARD_REASONS_CACHE_TTL, load_reward_reasons, 
+                  tables={'reward_reason'})
+
 @app.route('/admin/reward_reasons')
 @login_required
 def admin_reward_reasons():
@@ -867,12 +2533,21 @@ def update_reward_reasons_order():
         return jsonify({'error': 'Доступ запрещен'}), 403
     
     try:
-        data = request.json
-        for item in data:
-            reason = RewardReason.query.get(item['id'])
-            if reason:
-                reason.order = item['order']
-        
+        orders = {int(item['id']): int(item['order']) for item in request.json}
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Некорректные данные'}), 400
+    
+    if not orders:
+        return jsonify({'success': True, 'message': 'Порядок сохранен'})
+    
+    try:
+        # Весь новый порядок одним UPDATE ... CASE id
+        reasons = RewardReason.__table__
+        db.session.execute(
+            reasons.update()
+            .where(reasons.c.id.in_(orders.keys()))
+            .values(order=case(orders, value=reasons.c.id))
+        )
         db.session.commit()
         return jsonify({'success': True, 'message': 'Порядок сохранен'})
     except Exception as e:
@@ -1020,22 +2695,235 @@ def delete_tip_item(tip_id):
     flash('Причина удалена', 'success')
     return redirect(url_for('admin_tips'))
 
+# ========== ВЫГРУЗКИ ==========
+# CSV со всеми строками журнала баллов и заказов. Строки читаются курсором на
+# стороне сервера пачками по EXPORT_BATCH и сразу уходят клиенту, поэтому
+# память не растет с размером выгрузки. BOM в начале нужен, чтобы Excel
+# открывал кириллицу без выбора кодировки.
+EXPORT_BATCH = 2000
+
+def export_filters(args):
+    filters = {}
+    for name in ('date_from', 'date_to'):
+        value = args.get(name, '').strip()
+        if value:
+            filters[name] = datetime.strptime(value, '%Y-%m-%d')
+    
+    group_id = args.get('group_id', '')
+    if group_id == 'none' or group_id.isdigit():
+        filters['group_id'] = group_id
+    
+    status = args.get('status', '')
+    if status in ORDER_STATUSES:
+        filters['status'] = status
+    return filters
+
+def filter_export(query, created_at, filters):
+    if 'date_from' in filters:
+        query = query.filter(created_at >= filters['date_from'])
+    if 'date_to' in filters:
+        query = query.filter(created_at < filters['date_to'] + timedelta(days=1))
+    if filters.get('group_id') == 'none':
+        query = query.filter(User.group_id.is_(None))
+    elif 'group_id' in filters:
+        query = query.filter(User.group_id == int(filters['group_id']))
+    return query
+
+def points_history_export(filters):
+    changed_by = aliased(User)
+    query = db.session.query(
+        PointsHistory.id, PointsHistory.created_at, User.username, User.last_name, User.first_name,
+        Group.name, PointsHistory.points_change, PointsHistory.reason, changed_by.username
+    ).join(User, PointsHistory.user_id == User.id) \
+        .outerjoin(Group, User.group_id == Group.id) \
+        .outerjoin(changed_by, PointsHistory.changed_by_id == changed_by.id)
+    
+    query = filter_export(query, PointsHistory.created_at, filters)
+    header = ['id', 'Дата', 'Логин', 'Фамилия', 'Имя', 'Группа', 'Баллы', 'Причина', 'Кто изменил']
+    return header, query.order_by(PointsHistory.id)
+
+def orders_export(filters):
+    query = db.session.query(
+        Order.id, Order.created_at, Order.status, User.username, User.last_name, User.first_name,
+        Group.name, Product.name, Order.quantity, ORDER_PRICE
+    ).join(User, Order.student_id == User.id) \
+        .join(Product, Order.product_id == Product.id) \
+        .outerjoin(Group, User.group_id == Group.id)
+    
+    query = filter_export(query, Order.created_at, filters)
+    if 'status' in filters:
+        query = query.filter(Order.status == filters['status'])
+    header = ['id', 'Дата', 'Статус', 'Логин', 'Фамилия', 'Имя', 'Группа', 'Товар', 'Количество', 'Цена']
+    return header, query.order_by(Order.id)
+
+# Excel исполняет ячейку, начинающуюся с =, +, -, @, табуляции или перевода
+# строки, как формулу. Текст из базы (причины, имена, товары) экранируется
+# апострофом; числа остаются числами.
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def csv_cell(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def stream_csv(header, query):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for i, row in enumerate(query.yield_per(EXPORT_BATCH), 1):
+        writer.writerow([csv_cell(value) for value in row])
+        if i % EXPORT_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+EXPORTS = {
+    'points_history': points_history_export,
+    'orders': orders_export,
+}
+
+@app.route('/admin/export/<name>.csv')
+@login_required
+def export_csv(name):
+    if current_user.role != 'admin':
+        return redirect(url_for('index'))
+    if name not in EXPORTS:
+        return jsonify({'error': 'Неизвестная выгрузка'}), 404
+    
+    try:
+        filters = export_filters(request.args)
+    except ValueError:
+        return jsonify({'error': 'Дата должна быть в формате ГГГГ-ММ-ДД'}), 400
+    
+    header, query = EXPORTS[name](filters)
+    response = Response(stream_with_context(stream_csv(header, query)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename={name}_{datetime.now().strftime("%Y%m%d")}.csv'
+    return response
+
 # ========== ПРЕПОДАВАТЕЛЬ ==========
 
+# Группы преподавателя с числом учеников и суммой баллов одним GROUP BY
+# и пятерка лучших учеников вторым запросом
+def teacher_dashboard_stats(teacher_id):
+    rows = db.session.query(
+        Group.id,
+        Group.name,
+        db.func.count(User.id),
+        db.func.coalesce(db.func.sum(User.points), 0)
+    ).outerjoin(User, and_(User.group_id == Group.id, User.role == 'student')) \
+        .filter(Group.teacher_id == teacher_id) \
+        .group_by(Group.id, Group.name) \
+        .order_by(Group.id).all()
+    
+    groups = [
+        {'id': group_id, 'name': name, 'student_count': student_count, 'total_points': total_points}
+        for group_id, name, student_count, total_points in rows
+    ]
+    
+    top_rows = db.session.query(User.first_name, User.last_name, User.points, Group.name) \
+        .join(Group, User.group_id == Group.id) \
+        .filter(Group.teacher_id == teacher_id, User.role == 'student') \
+        .order_by(User.points.desc(), User.id).limit(5).all()
+    
+    top_students = [
+        {'first_name': first_name, 'last_name': last_name, 'points': points, 'group_name': group_name}
+        for first_name, last_name, points, group_name in top_rows
+    ]
+    
+    return {
+        'groups': groups,
+        'total_students': sum(group['student_count'] for group in groups),
+        'total_points': sum(group['total_points'] for group in groups),
+        'top_students': top_students
+    }
+
 @app.route('/teacher')
 @login_required
 def teacher_dashboard():
     if current_user.role != 'teacher':
         return redirect(url_for('index'))
     
-    groups = Group.query.filter_by(teacher_id=current_user.id).all()
+    teacher_id = current_user.id
+    stats = cached(f'teacher_dashboard:{teacher_id}', DASHBOARD_CACHE_TTL, 
+                   lambda: teacher_dashboard_stats(teacher_id), tables={'user', 'group'})
     
-    total_students = 0
-    for group in groups:
-        student_count = User.query.filter_by(group_id=group.id, role='student').count()
-        total_students += student_count
+    return render_template('teacher/dashboard.html', **stats)
+
+# Массовое начисление баллов: причины и ученики загружаются двумя запросами,
+# а изменения записываются одним UPDATE и одним многострочным INSERT.
+# Если хотя бы одна строка не проходит проверку, не записывается ничего.
+def bulk_award_points(data, changed_by_id, teacher_group_ids):
+    if not isinstance(data, dict) or not data:
+        return [], 'Не выбрано ни одной причины для начисления'
     
-    return render_template('teacher/dashboard.html', groups=groups, total_students=total_students)
+    try:
+        requested = {
+            int(student_id): [int(reason_data['reason_id']) for reason_data in reasons]
+            for student_id, reasons in data.items()
+        }
+    except (KeyError, TypeError, ValueError):
+        return [], 'Некорректные данные для начисления'
+    
+    reason_ids = {reason_id for ids in requested.values() for reason_id in ids}
+    reasons = {reason['id']: reason for reason in reward_reasons() if reason['id'] in reason_ids}
+    
+    student_groups = dict(
+        db.session.query(User.id, User.group_id).filter(User.id.in_(requested.keys())).all()
+    )
+    
+    results = []
+    has_errors = False
+    for student_id, ids in requested.items():
+        result = {'student_id': student_id, 'points': 0, 'reasons': []}
+        
+        if student_id not in student_groups:
+            result['error'] = 'Ученик не найден'
+        elif student_groups[student_id] not in teacher_group_ids:
+            result['error'] = 'Нет доступа к ученику'
+        elif any(reason_id not in reasons for reason_id in ids):
+            result['error'] = 'Причина начисления не найдена'
+        else:
+            result['points'] = sum(reasons[reason_id]['points'] for reason_id in ids)
+            result['reasons'] = [reasons[reason_id]['reason'] for reason_id in ids]
+        
+        if 'error' in result:
+            has_errors = True
+        results.append(result)
+    
+    if has_errors:
+        return results, 'Начисление отменено: есть ошибки в данных'
+    
+    results = [result for result in results if result['points'] > 0]
+    if not results:
+        return [], 'Не выбрано ни одной причины для начисления'
+    
+    awards = {result['student_id']: result['points'] for result in results}
+    points_change = case(awards, value=User.__table__.c.id)
+    users = User.__table__
+    db.session.execute(
+        users.update()
+        .where(users.c.id.in_(awards.keys()))
+        .values(points=users.c.points + points_change,
+                earned_points=users.c.earned_points + points_change)
+        .execution_options(changed_user_ids=set(awards))
+    )
+    db.session.execute(PointsHistory.__table__.insert(), [
+        {
+            'user_id': result['student_id'],
+            'points_change': result['points'],
+            'reason': 'Массовое начисление: ' + ', '.join(result['reasons']),
+            'changed_by_id': changed_by_id,
+        }
+        for result in results
+    ])
+    
+    return results, None
 
 @app.route('/teacher/students', methods=['GET', 'POST'])
 @login_required
@@ -1043,10 +2931,30 @@ def teacher_students():
     if current_user.role != 'teacher':
         return redirect(url_for('index'))
     
-    groups = Group.query.filter_by(teacher_id=current_user.id).all()
+    if request.method == 'POST':
+        try:
+            data = request.get_json()
+            teacher_group_ids = {
+                group_id for group_id, in 
+                db.session.query(Group.id).filter(Group.teacher_id == current_user.id).all()
+            }
+            results, error = bulk_award_points(data, current_user.id, teacher_group_ids)
+            
+            if error:
+                db.session.rollback()
+                return jsonify({'success': False, 'error': error, 'results': results}), 400
+            
+            db.session.commit()
+            students_updated = len(results)
+            total_points = sum(result['points'] for result in results)
+            message = f'Успешно начислено {total_points} баллов {students_updated} ученикам'
+            return jsonify({'success': True, 'message': message, 'results': results})
+        
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': f'Ошибка: {str(e)}'}), 500
     
-    for group in groups:
-        group.student_count = User.query.filter_by(group_id=group.id, role='student').count()
+    groups = groups_with_student_counts(Group.teacher_id == current_user.id)
     
     if not groups:
         flash('У вас нет назначенных групп', 'warning')
@@ -1061,66 +2969,17 @@ def teacher_students():
             selected_group_id = int(selected_group_id)
             selected_group = Group.query.get(selected_group_id)
             if selected_group and selected_group.teacher_id == current_user.id:
-                students = User.query.filter_by(group_id=selected_group_id, role='student').order_by(User.earned_points.desc()).all()
-                for i, student in enumerate(students, 1):
-                    student.rating_position = i
+                students = group_leaderboard(selected_group_id)
             else:
                 flash('У вас нет доступа к этой группе', 'error')
         except Exception as e:
             flash(f'Ошибка загрузки группы: {str(e)}', 'error')
     
-    reward_reasons = RewardReason.query.order_by(RewardReason.order).all()
-    
-    if request.method == 'POST':
-        try:
-            data = request.get_json()
-            students_updated = 0
-            total_points = 0
-            
-            for student_id, reasons in data.items():
-                student = User.query.get(int(student_id))
-                
-                if student and student.group and student.group.teacher_id == current_user.id:
-                    student_points = 0
-                    student_reasons = []
-                    
-                    for reason_data in reasons:
-                        reason = RewardReason.query.get(reason_data['reason_id'])
-                        if reason:
-                            student_points += reason.points
-                            student_reasons.append(reason.reason)
-                    
-                    if student_points > 0:
-                        student.points += student_points
-                        student.earned_points += student_points
-                        
-                        history = PointsHistory(
-                            user_id=student.id,
-                            points_change=student_points,
-                            reason='Массовое начисление: ' + ', '.join(student_reasons),
-                            changed_by_id=current_user.id
-                        )
-                        db.session.add(history)
-                        
-                        students_updated += 1
-                        total_points += student_points
-            
-            if students_updated > 0:
-                db.session.commit()
-                message = f'Успешно начислено {total_points} баллов {students_updated} ученикам'
-                return jsonify({'success': True, 'message': message})
-            else:
-                return jsonify({'success': False, 'error': 'Не выбрано ни одной причины для начисления'}), 400
-        
-        except Exception as e:
-            db.session.rollback()
-            return jsonify({'success': False, 'error': f'Ошибка: {str(e)}'}), 500
-    
     return render_template('teacher/teacher_students_new.html', 
                          students=students, 
                          groups=groups, 
                          selected_group=selected_group,
-                         reward_reasons=reward_reasons)
+                         reward_reasons=reward_reasons())
 
 @app.route('/teacher/group/<int:group_id>')
 @login_required
@@ -1133,10 +2992,7 @@ def teacher_group_detail(group_id):
         flash('У вас нет доступа к этой группе', 'error')
         return redirect(url_for('teacher_dashboard'))
     
-    students = User.query.filter_by(group_id=group_id, role='student').order_by(User.earned_points.desc()).all()
-    
-    for i, student in enumerate(students, 1):
-        student.rating_position = i
+    students = group_leaderboard(group_id)
     
     return render_template('teacher/group_detail.html', group=group, students=students)
 
@@ -1146,9 +3002,7 @@ def teacher_shop():
     if current_user.role != 'teacher':
         return redirect(url_for('index'))
     
-    products = Product.query.all()
-    categories = db.session.query(Product.category).distinct().all()
-    categories = [c[0] for c in categories]
+    products, categories = shop_catalog()
     
     return render_template('teacher/shop.html', products=products, categories=categories)
 
@@ -1163,7 +3017,11 @@ def student_dashboard():
     history = PointsHistory.query.filter_by(user_id=current_user.id).order_by(PointsHistory.created_at.desc()).limit(10).all()
     tip = Tip.query.first()
     
-    return render_template('student/dashboard.html', history=history, tip=tip)
+    group = None
+    if current_user.group_id:
+        group = next(iter(groups_with_student_counts(Group.id == current_user.group_id)), None)
+    
+    return render_template('student/dashboard.html', history=history, tip=tip, group=group)
 
 @app.route('/student/shop')
 @login_required
@@ -1171,12 +3029,50 @@ def student_shop():
     if current_user.role != 'student':
         return redirect(url_for('index'))
     
-    products = Product.query.filter(Product.quantity > 0).all()
-    categories = db.session.query(Product.category).distinct().all()
-    categories = [c[0] for c in categories]
+    products, categories = shop_catalog(in_stock_only=True)
     
     return render_template('student/shop.html', products=products, categories=categories)
 
+PURCHASE_RETRIES = 5
+
+# Покупка без гонок между воркерами: остаток и баланс уменьшаются условными
+# UPDATE, поэтому товар не уйдет в минус, а баланс не станет отрицательным.
+# Товар всегда блокируется раньше ученика, чтобы транзакции не ждали друг друга по кругу.
+def purchase_product(student_id, product_id, price):
+    products = Product.__table__
+    users = User.__table__
+    
+    reserved = db.session.execute(
+        products.update()
+        .where(products.c.id == product_id, products.c.quantity >= 1)
+        .values(quantity=products.c.quantity - 1)
+    )
+    if reserved.rowcount != 1:
+        db.session.rollback()
+        return None, 'Товар закончился'
+    
+    debited = db.session.execute(
+        users.update()
+        .where(users.c.id == student_id, users.c.points >= price)
+        .values(points=users.c.points - price)
+        .execution_options(changed_user_ids={student_id})
+    )
+    if debited.rowcount != 1:
+        db.session.rollback()
+        return None, 'Недостаточно баллов'
+    
+    order = Order(
+        student_id=student_id,
+        product_id=product_id,
+        quantity=1,
+        price=price,
+        status='pending'
+    )
+    db.session.add(order)
+    db.session.commit()
+    
+    return order.id, None
+
 @app.route('/student/shop/buy/<int:product_id>', methods=['POST'])
 @login_required
 def buy_product(product_id):
@@ -1191,24 +3087,30 @@ def buy_product(product_id):
     if current_user.points < product.price:
         return jsonify({'error': 'Недостаточно баллов'}), 400
     
-    order = Order(
-        student_id=current_user.id,
-        product_id=product.id,
-        quantity=1,
-        status='pending'
-    )
+    price = product.price
+    student_id = current_user.id
     
-    current_user.points -= product.price
-    product.quantity -= 1
+    for attempt in range(PURCHASE_RETRIES):
+        try:
+            order_id, error = purchase_product(student_id, product_id, price)
+            break
+        except OperationalError:
+            # Блокировка SQLite или конфликт сериализации PostgreSQL — пробуем ещё раз
+            db.session.rollback()
+            if attempt == PURCHASE_RETRIES - 1:
+                return jsonify({'error': 'Магазин перегружен, попробуйте ещё раз'}), 503
+            time.sleep(random.uniform(0.01, 0.05) * (attempt + 1))
     
-    db.session.add(order)
-    db.session.commit()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    new_balance = db.session.query(User.points).filter_by(id=student_id).scalar()
     
     return jsonify({
         'success': True, 
         'message': 'Товар куплен!', 
-        'new_balance': current_user.points,
-        'order_id': order.id
+        'new_balance': new_balance,
+        'order_id': order_id
     })
 
 @app.route('/student/profile')
@@ -1217,23 +3119,23 @@ def student_profile():
     if current_user.role != 'student':
         return redirect(url_for('index'))
     
-    history = PointsHistory.query.filter_by(user_id=current_user.id).order_by(PointsHistory.created_at.desc()).all()
+    history, next_history_cursor = history_page(current_user, request.args.get('history_cursor'))
+    history_summary = history_totals(current_user.id)
+    monthly_points = points_rollup(current_user.id, 'month')
     
-    rating_position = None
-    if current_user.group_id:
-        group_students = User.query.filter_by(
-            group_id=current_user.group_id, 
-            role='student'
-        ).order_by(User.earned_points.desc()).all()
-        
-        for i, student in enumerate(group_students, 1):
-            if student.id == current_user.id:
-                rating_position = i
-                break
+    rating_neighbours = leaderboard_neighbours(current_user)
+    rating_position = current_user.rating_position if rating_neighbours else None
     
     tips = TipItem.query.order_by(TipItem.created_at.desc()).all()
     
-    return render_template('student/profile.html', history=history, rating_position=rating_position, tips=tips)
+    return render_template('student/profile.html', 
+                         history=history, 
+                         next_history_cursor=next_history_cursor, 
+                         history_summary=history_summary, 
+                         monthly_points=monthly_points, 
+                         rating_position=rating_position, 
+                         rating_neighbours=rating_neighbours, 
+                         tips=tips)
 
 @app.route('/student/group_rating')
 @login_required
@@ -1245,44 +3147,348 @@ def student_group_rating():
         flash('Вы не состоите в группе', 'warning')
         return redirect(url_for('student_dashboard'))
     
-    students = User.query.filter_by(
-        group_id=current_user.group_id, 
-        role='student'
-    ).order_by(User.earned_points.desc()).all()
-    
-    for i, student in enumerate(students, 1):
-        student.rating_position = i
+    students = group_leaderboard(current_user.group_id)
     
     group = Group.query.get(current_user.group_id)
     
     return render_template('student/group_rating.html', students=students, group=group)
 
+STUDENTS_API_FIELDS = ('id', 'name', 'group', 'points', 'earned_points')
+STUDENTS_API_MAX_LIMIT = 500
+STUDENTS_API_BATCH = 500
+
+# ETag по строкам страницы, которые попадут в ответ: меняется при любом
+# изменении выводимых полей, а не только их сумм. Ответ без limit читается
+# потоком за один проход, поэтому ETag у него нет.
+def students_etag(args, rows, next_cursor=None):
+    digest = hashlib.sha1(repr((sorted(args), next_cursor)).encode())
+    for row in rows:
+        digest.update(repr(tuple(row)).encode())
+    return digest.hexdigest()
+
 @app.route('/api/filter/students')
 @login_required
 def filter_students():
     group_id = request.args.get('group_id')
+    output_format = request.args.get('format', 'json')
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor', type=int)
+    
+    fields = [field for field in request.args.get('fields', '').split(',') if field in STUDENTS_API_FIELDS]
+    if not fields:
+        fields = list(STUDENTS_API_FIELDS)
+    
+    query = db.session.query(
+        User.id, User.first_name, User.last_name, User.points, User.earned_points, Group.name
+    ).outerjoin(Group, User.group_id == Group.id).filter(User.role == 'student')
     
     if group_id:
-        students = User.query.filter_by(group_id=group_id, role='student').all()
+        query = query.filter(User.group_id == group_id)
+    
+    # Keyset-пагинация по id: cursor — id последнего ученика предыдущей страницы
+    if cursor:
+        query = query.filter(User.id > cursor)
+    query = query.order_by(User.id)
+    
+    next_cursor = etag = None
+    if limit is not None:
+        limit = max(1, min(limit, STUDENTS_API_MAX_LIMIT))
+        rows = query.limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1].id
+        
+        etag = students_etag(request.args.items(multi=True), rows, next_cursor)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+    else:
+        rows = query.yield_per(STUDENTS_API_BATCH)
+    
+    def serialize(row):
+        student = {
+            'id': row.id,
+            'name': f'{row.first_name} {row.last_name}',
+            'group': row.name if row.name else 'Без группы',
+            'points': row.points,
+            'earned_points': row.earned_points
+        }
+        return json.dumps({field: student[field] for field in fields}, ensure_ascii=False)
+    
+    # Ответ отдается по частям, поэтому память не зависит от числа учеников
+    def generate_ndjson():
+        for row in rows:
+            yield serialize(row) + '\n'
+    
+    def generate_json():
+        yield '['
+        for i, row in enumerate(rows):
+            yield (',' if i else '') + serialize(row)
+        yield ']'
+    
+    if output_format == 'ndjson':
+        response = Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
     else:
-        students = User.query.filter_by(role='student').all()
+        response = Response(stream_with_context(generate_json()), mimetype='application/json')
     
-    result = []
-    for student in students:
-        result.append({
-            'id': student.id,
-            'name': f'{student.first_name} {student.last_name}',
-            'group': student.group.name if student.group else 'Без группы',
-            'points': student.points,
-            'earned_points': student.earned_points
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    
+    return response
+
+# ========== КОМАНДЫ ==========
+
+points_cli = AppGroup('points', help='Журнал баллов')
+
+@points_cli.command('snapshot')
+def snapshot_points_command():
+    updated = snapshot_points_balances()
+    click.echo(f'Снимки обновлены для {updated} учеников')
+
+# earned_points должен совпадать с суммой начислений в журнале. Текущий баланс
+# сверяется с журналом за вычетом невозвращенных заказов по цене покупки
+# (у старых заказов — по текущей цене товара), поэтому исправляется только
+# earned_points.
+@points_cli.command('verify')
+@click.option('--fix', is_flag=True, help='Пересчитать earned_points по журналу')
+def verify_points_command(fix):
+    totals = ledger_totals()
+    
+    spent = dict(db.session.query(
+        Order.student_id,
+        db.func.sum(ORDER_PRICE * Order.quantity)
+    ).join(Product, Order.product_id == Product.id) \
+        .filter(Order.status != 'cancelled') \
+        .group_by(Order.student_id).all())
+    
+    mismatches = 0
+    for user in User.query.filter_by(role='student').order_by(User.id).all():
+        balance, earned = totals.get(user.id, (0, 0))
+        expected_points = balance - spent.get(user.id, 0)
+        
+        if user.earned_points != earned or user.points != expected_points:
+            mismatches += 1
+            click.echo(f'{user.username}: earned_points {user.earned_points} (журнал {earned}), '
+                       f'points {user.points} (журнал {expected_points})')
+            if fix:
+                user.earned_points = earned
+    
+    if fix:
+        db.session.commit()
+    
+    click.echo(f'Расхождений: {mismatches}')
+
+app.cli.add_command(points_cli)
+
+users_cli = AppGroup('users', help='Пользователи')
+
+def print_import_report(report, elapsed):
+    summary = {}
+    for row in report:
+        summary[row['status']] = summary.get(row['status'], 0) + 1
+        if row['status'] not in ('ok', 'created'):
+            click.echo(f'Строка {row["line"]} ({row["username"]}): {row["message"]}')
+    
+    click.echo(', '.join(f'{status}: {count}' for status, count in sorted(summary.items())))
+    click.echo(f'{len(report)} строк за {elapsed:.2f} с ({len(report) / max(elapsed, 1e-9):.0f} строк/с)')
+
+@users_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Только проверить файл')
+def import_users_command(path, dry_run):
+    started = time.perf_counter()
+    with open(path, 'rb') as stream:
+        report = import_users(read_users_csv(stream), dry_run=dry_run)
+    
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    
+    print_import_report(report, time.perf_counter() - started)
+
+# Замер скорости импорта на сгенерированных строках; транзакция откатывается
+@users_cli.command('bench-import')
+@click.option('--rows', default=2000, show_default=True)
+def bench_import_command(rows):
+    prefix = f'bench{int(time.time())}_'
+    generated = (
+        (i + 2, {
+            'username': f'{prefix}{i}',
+            'password': f'pass{i}',
+            'first_name': 'Ученик',
+            'last_name': f'Тестовый{i}',
+            'role': 'student',
+            'group': ''
         })
+        for i in range(rows)
+    )
     
-    return jsonify(result)
+    started = time.perf_counter()
+    report = import_users(generated)
+    elapsed = time.perf_counter() - started
+    db.session.rollback()
+    
+    print_import_report(report, elapsed)
+
+app.cli.add_command(users_cli)
+
+images_cli = AppGroup('images', help='Изображения товаров')
+
+def read_legacy_image(image):
+    path = image if image.startswith('static/') else os.path.join('static', image)
+    with open(path, 'rb') as image_file:
+        return image_file.read()
+
+# Переводит старые загрузки на размеры в WebP; картинки обрабатываются в пуле процессов
+@images_cli.command('rebuild')
+@click.option('--workers', default=None, type=int, help='Число процессов (по умолчанию — число ядер)')
+def rebuild_images_command(workers):
+    products = [
+        product for product in Product.query.filter(Product.image.isnot(None)).all()
+        if os.path.splitext(product.image)[1]
+    ]
+    if not products:
+        click.echo('Нет изображений для обработки')
+        return
+    
+    folder = app.config['UPLOAD_FOLDER']
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for product in products:
+            try:
+                data = read_legacy_image(product.image)
+            except OSError as e:
+                click.echo(f'{product.name}: файл не найден ({e})')
+                continue
+            futures[pool.submit(process_product_image, data, folder)] = product
+        
+        for future, product in futures.items():
+            try:
+                product.image = f'{PRODUCT_IMAGE_PREFIX}/{future.result()}'
+            except (OSError, Image.DecompressionBombError) as e:
+                click.echo(f'{product.name}: не удалось обработать ({e})')
+    
+    mark_tables_changed(db.session, {'catalog'})
+    db.session.commit()
+    click.echo(f'Обработано изображений: {len(futures)}')
+
+app.cli.add_command(images_cli)
+
+assets_cli = AppGroup('assets', help='Стили и скрипты')
+
+@assets_cli.command('build')
+@click.option('--clean', is_flag=True, help='Удалить файлы прежних сборок')
+def build_assets_command(clean):
+    stats = build_assets(clean=clean)
+    for item in stats:
+        click.echo(f'{item["source"]:45} {item["original"]:>8} -> {item["minified"]:>8}'
+                   f'  gzip {item.get("gzip", "-"):>6}  br {item.get("br", "-"):>6}')
+    click.echo(f'Собрано файлов: {len(stats)}, '
+               f'{sum(item["original"] for item in stats)} -> {sum(item["minified"] for item in stats)} байт')
+
+app.cli.add_command(assets_cli)
+
+@app.cli.command('init-db')
+@click.option('--no-test-data', is_flag=True, help='Только таблицы, администратор и группы')
+def init_db_command(no_test_data):
+    init_database(test_data=not no_test_data)
+
+db_cli = AppGroup('db', help='Схема базы данных')
+
+@db_cli.command('upgrade')
+def db_upgrade_command():
+    upgraded = upgrade_database()
+    for version, description in upgraded:
+        click.echo(f'Применена миграция {version}: {description}')
+    if not upgraded:
+        click.echo('Схема уже актуальна')
+
+@db_cli.command('status')
+def db_status_command():
+    applied = applied_migrations()
+    for version, description, names in MIGRATIONS:
+        mark = 'x' if version in applied else ' '
+        click.echo(f'[{mark}] {version}: {description} ({", ".join(names)})')
+
+app.cli.add_command(db_cli)
+
+perf_cli = AppGroup('perf', help='Производительность')
+
+# Обходит основные страницы под первым админом, преподавателем и учеником
+# в строгом режиме и падает, если какая-то страница превысила бюджет запросов
+@perf_cli.command('check')
+def perf_check_command():
+    app.config['SQL_PROFILE'] = True
+    app.config['SQL_BUDGET_STRICT'] = True
+    app.testing = True
+    
+    def first(query):
+        row = query.order_by(None).first()
+        return row.id if row else None
+    
+    admin_id = first(User.query.filter_by(role='admin'))
+    teacher = User.query.filter_by(role='teacher').first()
+    student_id = first(User.query.filter_by(role='student'))
+    group_id = first(Group.query)
+    teacher_group_id = teacher.taught_groups[0].id if teacher and teacher.taught_groups else None
+    
+    pages = [
+        (admin_id, '/admin'), (admin_id, '/admin/users'), (admin_id, '/admin/groups'),
+        (admin_id, f'/admin/groups/{group_id}'), (admin_id, f'/admin/users/{student_id}'),
+        (admin_id, '/admin/shop'), (admin_id, '/admin/orders'), 
+        (admin_id, '/admin/reward_reasons'), (admin_id, '/admin/tips'),
+        (teacher and teacher.id, '/teacher'), (teacher and teacher.id, '/teacher/students'),
+        (teacher and teacher.id, f'/teacher/group/{teacher_group_id}'),
+        (teacher and teacher.id, '/teacher/shop'),
+        (student_id, '/student'), (student_id, '/student/shop'), (student_id, '/student/profile'),
+        (student_id, '/student/group_rating'), (student_id, '/api/filter/students'),
+    ]
+    db.session.remove()
+    
+    failed = 0
+    for user_id, path in pages:
+        if user_id is None or 'None' in path:
+            click.echo(f'SKIP {path}')
+            continue
+        
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        endpoint = app.url_map.bind('localhost').match(path)[0]
+        queries_before = _sql_profile.get(endpoint, {}).get('queries', 0)
+        try:
+            # Свой контекст приложения, чтобы g (и current_user) не переходил между запросами
+            with app.app_context():
+                response = client.get(path)
+                # Потоковый ответ читает базу, пока отдается тело, и проверяется при закрытии
+                response.get_data()
+                response.close()
+        except QueryBudgetExceeded as error:
+            failed += 1
+            click.echo(f'FAIL {path}: {error}')
+            continue
+        queries = _sql_profile.get(endpoint, {}).get('queries', 0) - queries_before
+        click.echo(f'ok   {path}: {response.status_code}, '
+                   f'{queries} запросов, '
+                   f'{response.headers.get("X-SQL-Time", "потоковый ответ")}, '
+                   f'повторов {response.headers.get("X-SQL-Repeated", 0)}')
+    
+    if failed:
+        raise SystemExit(1)
+
+app.cli.add_command(perf_cli)
 
 @app.context_processor
 def inject_now():
     return {'datetime': datetime}
 
 if __name__ == '__main__':
+    init_database()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,1111 @@
+"""Нагрузочные замеры магазина баллов.
+
+    python bench.py seed --students 20000 --groups 300 --history 2000000
+    python bench.py run --mode client --output bench-results/before.json
+    python bench.py run --mode gunicorn --workers 4 --concurrency 8
+    python bench.py modes --workers 2 --threads 4 --concurrency 8
+    python bench.py login --method pbkdf2:sha256:600000 --method scrypt:32768:8:1
+    python bench.py startup
+    python bench.py plans --drop-indexes
+    python bench.py export
+    python bench.py bus --workers 4
+    python bench.py buy-stress --workers 8 --purchases 4000
+    python bench.py assets
+    python bench.py compare bench-results/before.json bench-results/after.json
+
+База берется из DATABASE_URL, как и в приложении. Все данные замеров
+создаются с префиксом bench_ и удаляются через seed --reset.
+"""
+import click
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import re
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam
+from werkzeug.security import generate_password_hash
+
+from app import app, db, User, Group, PointsHistory, PointsSnapshot, Product, Order, \
+    RewardReason, create_index_online, init_database, leaderboard_query, migration_indexes, \
+    model_index, snapshot_points_balances
+
+BENCH_PREFIX = 'bench_'
+BENCH_PASSWORD = 'bench123'
+BENCH_START_POINTS = 100000
+SEED_BATCH_SIZE = 20000
+PERCENTILES = (50, 90, 95, 99)
+AWARD_STUDENTS = 20
+
+@click.group()
+def cli():
+    pass
+
+# ========== ДАННЫЕ ==========
+
+def bench_user_ids(role=None):
+    query = db.session.query(User.id).filter(User.username.startswith(BENCH_PREFIX))
+    if role:
+        query = query.filter(User.role == role)
+    return [user_id for user_id, in query.all()]
+
+def delete_bench_data():
+    user_ids = bench_user_ids()
+    for start in range(0, len(user_ids), SEED_BATCH_SIZE):
+        chunk = user_ids[start:start + SEED_BATCH_SIZE]
+        PointsHistory.query.filter(PointsHistory.user_id.in_(chunk)).delete(synchronize_session=False)
+        PointsHistory.query.filter(PointsHistory.changed_by_id.in_(chunk)).delete(synchronize_session=False)
+        PointsSnapshot.query.filter(PointsSnapshot.user_id.in_(chunk)).delete(synchronize_session=False)
+        Order.query.filter(Order.student_id.in_(chunk)).delete(synchronize_session=False)
+
+    bench_products = db.session.query(Product.id).filter(Product.name.startswith(BENCH_PREFIX))
+    Order.query.filter(Order.product_id.in_(bench_products)).delete(synchronize_session=False)
+    Product.query.filter(Product.name.startswith(BENCH_PREFIX)).delete(synchronize_session=False)
+    User.query.filter(User.username.startswith(BENCH_PREFIX), User.role == 'student') \
+        .delete(synchronize_session=False)
+    Group.query.filter(Group.name.startswith(BENCH_PREFIX)).delete(synchronize_session=False)
+    User.query.filter(User.username.startswith(BENCH_PREFIX)).delete(synchronize_session=False)
+    db.session.commit()
+
+def insert_batches(table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == SEED_BATCH_SIZE:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+
+def bench_user_row(username, role, password_hash, group_id=None, first_name='Замер'):
+    return {
+        'username': username,
+        'password': password_hash,
+        'visible_password': BENCH_PASSWORD,
+        'first_name': first_name,
+        'last_name': username,
+        'role': role,
+        'group_id': group_id,
+        'points': 0,
+        'earned_points': 0,
+        'created_at': datetime.utcnow(),
+    }
+
+# Баланс учеников сходится с журналом: points = сумма истории минус
+# невозвращенные заказы, earned_points = сумма начислений (flask points verify)
+@cli.command('seed')
+@click.option('--students', default=20000, show_default=True)
+@click.option('--groups', default=300, show_default=True)
+@click.option('--history', default=2000000, show_default=True, help='Строк PointsHistory')
+@click.option('--orders', default=20000, show_default=True)
+@click.option('--products', default=20, show_default=True)
+@click.option('--seed', default=1, show_default=True, help='Зерно генератора')
+@click.option('--reset', is_flag=True, help='Удалить прежние данные замеров')
+def seed_command(students, groups, history, orders, products, seed, reset):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    init_database()
+
+    with app.app_context():
+        if bench_user_ids():
+            if not reset:
+                raise click.ClickException('Данные замеров уже есть, используйте --reset')
+            delete_bench_data()
+            click.echo(f'Прежние данные удалены за {time.perf_counter() - started:.1f} с')
+
+        # Хэш у всех пользователей замеров один: PBKDF2 для каждого занял бы часы
+        password_hash = generate_password_hash(BENCH_PASSWORD)
+
+        users = User.__table__
+        insert_batches(users, [bench_user_row(f'{BENCH_PREFIX}admin', 'admin', password_hash)])
+        insert_batches(users, (
+            bench_user_row(f'{BENCH_PREFIX}t{i}', 'teacher', password_hash, first_name='Преподаватель')
+            for i in range(groups)
+        ))
+        teacher_ids = bench_user_ids('teacher')
+
+        insert_batches(Group.__table__, (
+            {'name': f'{BENCH_PREFIX}{i}', 'teacher_id': teacher_id}
+            for i, teacher_id in enumerate(teacher_ids)
+        ))
+        group_teachers = dict(db.session.query(Group.id, Group.teacher_id)
+                              .filter(Group.name.startswith(BENCH_PREFIX)).all())
+        group_ids = sorted(group_teachers)
+
+        insert_batches(users, (
+            bench_user_row(f'{BENCH_PREFIX}s{i}', 'student', password_hash,
+                           group_id=group_ids[i % len(group_ids)], first_name='Ученик')
+            for i in range(students)
+        ))
+        student_groups = dict(db.session.query(User.id, User.group_id)
+                              .filter(User.username.startswith(BENCH_PREFIX), User.role == 'student').all())
+        student_ids = sorted(student_groups)
+        db.session.commit()
+        click.echo(f'Пользователи и группы: {time.perf_counter() - started:.1f} с')
+
+        balance = dict.fromkeys(student_ids, BENCH_START_POINTS)
+        earned = dict.fromkeys(student_ids, BENCH_START_POINTS)
+        reasons = [(reason.reason, reason.points) for reason in RewardReason.query.all()] or [('Замер', 10)]
+        now = datetime.utcnow()
+
+        def history_rows():
+            for student_id in student_ids:
+                yield {
+                    'user_id': student_id,
+                    'points_change': BENCH_START_POINTS,
+                    'reason': 'Стартовые баллы для замеров',
+                    'changed_by_id': group_teachers[student_groups[student_id]],
+                    'created_at': now - timedelta(days=366),
+                }
+            for _ in range(max(history - len(student_ids), 0)):
+                student_id = rng.choice(student_ids)
+                reason, points = rng.choice(reasons)
+                if rng.random() < 0.05:
+                    reason, points = 'Списание', -rng.randint(1, 20)
+                balance[student_id] += points
+                if points > 0:
+                    earned[student_id] += points
+                yield {
+                    'user_id': student_id,
+                    'points_change': points,
+                    'reason': reason,
+                    'changed_by_id': group_teachers[student_groups[student_id]],
+                    'created_at': now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+                }
+
+        insert_batches(PointsHistory.__table__, history_rows())
+        db.session.commit()
+        click.echo(f'История баллов: {time.perf_counter() - started:.1f} с')
+
+        insert_batches(Product.__table__, (
+            {
+                'name': f'{BENCH_PREFIX}{i}',
+                'description': 'Товар для нагрузочных замеров',
+                'price': 10 + i,
+                'quantity': 10 ** 7,
+                'category': 'other',
+            }
+            for i in range(products)
+        ))
+        product_prices = dict(db.session.query(Product.id, Product.price)
+                              .filter(Product.name.startswith(BENCH_PREFIX)).all())
+        product_ids = sorted(product_prices)
+
+        def order_rows():
+            for _ in range(orders):
+                student_id = rng.choice(student_ids)
+                product_id = rng.choice(product_ids)
+                status = rng.choices(['pending', 'completed', 'cancelled'], weights=[2, 6, 1])[0]
+                if status != 'cancelled':
+                    balance[student_id] -= product_prices[product_id]
+                yield {
+                    'student_id': student_id,
+                    'product_id': product_id,
+                    'quantity': 1,
+                    'price': product_prices[product_id],
+                    'status': status,
+                    'created_at': now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+                }
+
+        insert_batches(Order.__table__, order_rows())
+
+        db.session.execute(
+            users.update().where(users.c.id == bindparam('student_id'))
+            .values(points=bindparam('new_points'), earned_points=bindparam('new_earned')),
+            [
+                {'student_id': student_id, 'new_points': balance[student_id],
+                 'new_earned': earned[student_id]}
+                for student_id in student_ids
+            ]
+        )
+        db.session.commit()
+        snapshot_points_balances()
+
+    click.echo(f'Готово за {time.perf_counter() - started:.1f} с: {students} учеников, '
+               f'{groups} групп, {max(history, students)} записей истории, {orders} заказов')
+
+# ========== КЛИЕНТЫ ==========
+
+class TestClient:
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, json_body=None):
+        # Свой контекст приложения на запрос, чтобы g не переходил между потоками
+        with app.app_context():
+            response = self.client.open(path, method=method, data=form, json=json_body)
+        return response.status_code, response.get_data()
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def request(self, method, path, form=None, json_body=None):
+        headers = {}
+        data = None
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        request = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+# ========== СЦЕНАРИИ ==========
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def timed(self, name, client, method, path, ok=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            status, body = client.request(method, path, **kwargs)
+        except Exception:
+            status, body = None, b''
+        elapsed = time.perf_counter() - started
+
+        with self.lock:
+            self.samples.setdefault(name, []).append(elapsed)
+            if status not in ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+        return status, body
+
+def login(recorder, client, username):
+    return recorder.timed('login', client, 'POST', '/login', ok=(302,),
+                          form={'username': username, 'password': BENCH_PASSWORD})
+
+def student_flow(recorder, client, rng, fixtures):
+    login(recorder, client, rng.choice(fixtures['students']))
+    recorder.timed('student.dashboard', client, 'GET', '/student')
+    recorder.timed('student.shop', client, 'GET', '/student/shop')
+    recorder.timed('student.buy', client, 'POST', f'/student/shop/buy/{rng.choice(fixtures["products"])}')
+    recorder.timed('student.profile', client, 'GET', '/student/profile')
+
+def teacher_flow(recorder, client, rng, fixtures):
+    teacher, student_ids = rng.choice(fixtures['teachers'])
+    login(recorder, client, teacher)
+    awards = {
+        str(student_id): [{'reason_id': fixtures['reason_id']}]
+        for student_id in rng.sample(student_ids, min(AWARD_STUDENTS, len(student_ids)))
+    }
+    recorder.timed('teacher.students', client, 'GET', '/teacher/students')
+    recorder.timed('teacher.bulk_award', client, 'POST', '/teacher/students', json_body=awards)
+
+def admin_flow(recorder, client, rng, fixtures):
+    login(recorder, client, f'{BENCH_PREFIX}admin')
+    recorder.timed('admin.dashboard', client, 'GET', '/admin')
+    recorder.timed('admin.orders', client, 'GET', '/admin/orders')
+    recorder.timed('admin.orders_pending', client, 'GET', '/admin/orders?status=pending')
+    recorder.timed('admin.users', client, 'GET', '/admin/users')
+    status, body = recorder.timed('admin.users_api', client, 'GET', '/api/admin/users?role=student')
+    if status == 200:
+        next_cursor = json.loads(body).get('next_cursor')
+        if next_cursor:
+            query = urllib.parse.urlencode({'role': 'student', 'cursor': next_cursor})
+            recorder.timed('admin.users_api_next', client, 'GET', f'/api/admin/users?{query}')
+
+SCENARIOS = {
+    'student': student_flow,
+    'teacher': teacher_flow,
+    'admin': admin_flow,
+}
+
+def load_fixtures():
+    with app.app_context():
+        students = [username for username, in db.session.query(User.username).filter(
+            User.username.startswith(BENCH_PREFIX), User.role == 'student').all()]
+        if not students:
+            raise click.ClickException('Нет данных замеров, сначала запустите bench.py seed')
+
+        group_students = {}
+        for group_id, student_id in db.session.query(User.group_id, User.id).filter(
+                User.username.startswith(BENCH_PREFIX), User.role == 'student').all():
+            group_students.setdefault(group_id, []).append(student_id)
+        teachers = [
+            (username, group_students[group_id])
+            for username, group_id in db.session.query(User.username, Group.id)
+                .join(Group, Group.teacher_id == User.id)
+                .filter(Group.name.startswith(BENCH_PREFIX)).all()
+            if group_id in group_students
+        ]
+
+        reason = RewardReason.query.order_by(RewardReason.order).first()
+        return {
+            'students': students,
+            'teachers': teachers,
+            'products': [product_id for product_id, in db.session.query(Product.id)
+                         .filter(Product.name.startswith(BENCH_PREFIX)).all()],
+            'reason_id': reason.id if reason else None,
+            'dataset': {
+                'users': db.session.query(db.func.count(User.id)).scalar(),
+                'groups': db.session.query(db.func.count(Group.id)).scalar(),
+                'points_history': db.session.query(db.func.count(PointsHistory.id)).scalar(),
+                'orders': db.session.query(db.func.count(Order.id)).scalar(),
+            },
+            'database': db.engine.url.get_backend_name(),
+        }
+
+def percentile(values, p):
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+def summarize(recorder, wall_time):
+    summary = {}
+    for name, samples in sorted(recorder.samples.items()):
+        samples = sorted(samples)
+        summary[name] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(name, 0),
+            'mean_ms': round(sum(samples) / len(samples) * 1000, 2),
+            'max_ms': round(samples[-1] * 1000, 2),
+            'throughput_rps': round(len(samples) / wall_time, 2),
+        }
+        for p in PERCENTILES:
+            summary[name][f'p{p}_ms'] = round(percentile(samples, p) * 1000, 2)
+    return summary
+
+def run_scenario(flow, make_client, iterations, concurrency, seed, fixtures):
+    recorder = Recorder()
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        for _ in range(index, iterations, concurrency):
+            flow(recorder, make_client(), rng, fixtures)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return summarize(recorder, time.perf_counter() - started)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# Запуск с конфигурацией из gunicorn.conf.py; аргументы командной строки ее перекрывают
+def start_gunicorn(workers, port, worker_class='sync', threads=1):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{port}',
+         '-w', str(workers), '-k', worker_class, '--threads', str(threads), 'app:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, LOGIN_RATE_LIMIT='0'),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=5):
+                return process
+        except (urllib.error.URLError, ConnectionError):
+            if process.poll() is not None:
+                break
+            time.sleep(0.5)
+    process.terminate()
+    raise click.ClickException('gunicorn не запустился')
+
+def run_scenarios(make_client, scenarios, iterations, concurrency, seed, fixtures):
+    results = {}
+    for name in scenarios or SCENARIOS:
+        click.echo(f'Сценарий {name}...')
+        results.update({
+            f'{name}:{step}': stats
+            for step, stats in run_scenario(SCENARIOS[name], make_client, iterations,
+                                            concurrency, seed, fixtures).items()
+        })
+    return results
+
+def run_on_gunicorn(workers, worker_class, threads, scenarios, iterations, concurrency, seed, fixtures):
+    port = free_port()
+    process = start_gunicorn(workers, port, worker_class, threads)
+    try:
+        return run_scenarios(lambda: HttpClient(f'http://127.0.0.1:{port}'), scenarios,
+                             iterations, concurrency, seed, fixtures)
+    finally:
+        process.terminate()
+        process.wait()
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@cli.command('run')
+@click.option('--mode', type=click.Choice(['client', 'gunicorn']), default='client', show_default=True)
+@click.option('--workers', default=4, show_default=True, help='Воркеры gunicorn')
+@click.option('--worker-class', default='sync', show_default=True, help='Класс воркеров gunicorn')
+@click.option('--threads', default=1, show_default=True, help='Потоков в воркере gthread')
+@click.option('--concurrency', default=4, show_default=True, help='Параллельных клиентов')
+@click.option('--iterations', default=100, show_default=True, help='Проходов каждого сценария')
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(list(SCENARIOS)))
+@click.option('--seed', default=1, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None)
+def run_command(mode, workers, worker_class, threads, concurrency, iterations, scenarios, seed, output):
+    fixtures = load_fixtures()
+    # Все входы идут с одного адреса, ограничение попыток исказило бы замер
+    app.config['LOGIN_RATE_LIMIT'] = False
+
+    if mode == 'gunicorn':
+        results = run_on_gunicorn(workers, worker_class, threads, scenarios, iterations,
+                                  concurrency, seed, fixtures)
+    else:
+        results = run_scenarios(TestClient, scenarios, iterations, concurrency, seed, fixtures)
+
+    report = {
+        'version': git_version(),
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': fixtures['database'],
+        'dataset': fixtures['dataset'],
+        'mode': mode,
+        'workers': workers if mode == 'gunicorn' else 1,
+        'worker_class': worker_class if mode == 'gunicorn' else None,
+        'threads': threads if mode == 'gunicorn' else None,
+        'concurrency': concurrency,
+        'iterations': iterations,
+        'results': results,
+    }
+
+    write_report(report, output)
+
+# Одни и те же сценарии на gunicorn с разными классами воркеров при одинаковом
+# числе процессов: пропускная способность и p99 каждого шага рядом
+@cli.command('modes')
+@click.option('--workers', default=2, show_default=True)
+@click.option('--threads', default=4, show_default=True, help='Потоков в воркере gthread')
+@click.option('--concurrency', default=8, show_default=True)
+@click.option('--iterations', default=40, show_default=True)
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(list(SCENARIOS)))
+@click.option('--seed', default=1, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None)
+def modes_command(workers, threads, concurrency, iterations, scenarios, seed, output):
+    fixtures = load_fixtures()
+    modes = {'sync': ('sync', 1), f'gthread{threads}': ('gthread', threads)}
+
+    results = {}
+    summary = {}
+    for mode, (worker_class, mode_threads) in modes.items():
+        click.echo(f'Режим {mode}...')
+        started = time.perf_counter()
+        mode_results = run_on_gunicorn(workers, worker_class, mode_threads, scenarios, iterations,
+                                       concurrency, seed, fixtures)
+        wall_time = time.perf_counter() - started
+        results.update({f'{mode}/{name}': stats for name, stats in mode_results.items()})
+        summary[mode] = {
+            'requests': sum(stats['requests'] for stats in mode_results.values()),
+            'errors': sum(stats['errors'] for stats in mode_results.values()),
+            'throughput_rps': round(sum(stats['requests'] for stats in mode_results.values()) / wall_time, 2),
+            'worst_p99_ms': max(stats['p99_ms'] for stats in mode_results.values()),
+        }
+
+    steps = sorted({name.split('/', 1)[1] for name in results})
+    click.echo(f'{"шаг":40}' + ''.join(f'{mode + " rps":>16}{mode + " p99":>16}' for mode in modes))
+    for step in steps:
+        click.echo(f'{step:40}' + ''.join(
+            f'{results[f"{mode}/{step}"]["throughput_rps"]:>16.1f}{results[f"{mode}/{step}"]["p99_ms"]:>16.1f}'
+            for mode in modes))
+    for mode, stats in summary.items():
+        click.echo(f'{mode}: {stats}')
+
+    save_report({
+        'version': git_version(),
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': fixtures['database'],
+        'dataset': fixtures['dataset'],
+        'mode': 'modes',
+        'workers': workers,
+        'threads': threads,
+        'concurrency': concurrency,
+        'iterations': iterations,
+        'summary': summary,
+        'results': results,
+    }, output)
+
+# Входов в секунду на один воркер для каждого метода хэширования и скорость
+# отказов, когда ограничение попыток уже сработало
+@cli.command('login')
+@click.option('--method', 'methods', multiple=True,
+              help='Метод хэширования, можно несколько (по умолчанию — текущий)')
+@click.option('--logins', default=30, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None)
+def login_command(methods, logins, output):
+    fixtures = load_fixtures()
+    username, attacked = fixtures['students'][:2]
+    original_method = app.config['PASSWORD_HASH_METHOD']
+    recorder = Recorder()
+    wall_times = {}
+
+    try:
+        app.config['LOGIN_RATE_LIMIT'] = False
+        for method in methods or [original_method]:
+            app.config['PASSWORD_HASH_METHOD'] = method
+            # Первый вход перехэширует пароль под новый метод
+            login(Recorder(), TestClient(), username)
+
+            name = f'login[{method}]'
+            started = time.perf_counter()
+            for _ in range(logins):
+                recorder.timed(name, TestClient(), 'POST', '/login', ok=(302,),
+                               form={'username': username, 'password': BENCH_PASSWORD})
+            wall_times[name] = time.perf_counter() - started
+
+        app.config['LOGIN_RATE_LIMIT'] = True
+        client = TestClient()
+        while client.request('POST', '/login', form={'username': attacked, 'password': 'wrong'})[0] != 429:
+            pass
+        started = time.perf_counter()
+        for _ in range(logins * 10):
+            recorder.timed('login[rejected]', client, 'POST', '/login', ok=(429,),
+                           form={'username': attacked, 'password': 'wrong'})
+        wall_times['login[rejected]'] = time.perf_counter() - started
+    finally:
+        app.config['PASSWORD_HASH_METHOD'] = original_method
+        app.config['LOGIN_RATE_LIMIT'] = False
+        login(Recorder(), TestClient(), username)
+
+    results = {}
+    for name, wall_time in wall_times.items():
+        single = Recorder()
+        single.samples[name] = recorder.samples[name]
+        single.errors = {name: recorder.errors.get(name, 0)}
+        results.update(summarize(single, wall_time))
+
+    write_report({
+        'version': git_version(),
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': fixtures['database'],
+        'dataset': fixtures['dataset'],
+        'mode': 'login',
+        'workers': 1,
+        'concurrency': 1,
+        'iterations': logins,
+        'results': results,
+    }, output)
+
+# Время импорта app.py в отдельном процессе, как при загрузке воркера. База
+# указывает в несуществующий каталог: если импорт к ней обратится, замер упадет
+@cli.command('startup')
+@click.option('--runs', default=5, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None)
+def startup_command(runs, output):
+    code = 'import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)'
+    env = dict(os.environ, DATABASE_URL='sqlite:////nonexistent/bench/startup.db')
+    recorder = Recorder()
+    recorder.samples['startup:import'] = []
+
+    started = time.perf_counter()
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode:
+            raise click.ClickException('Импорт app.py завершился ошибкой (обращение к базе?):\n' 
+                                       + result.stderr[-2000:])
+        recorder.samples['startup:import'].append(float(result.stdout.split()[-1]))
+
+    write_report({
+        'version': git_version(),
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': None,
+        'dataset': None,
+        'mode': 'startup',
+        'workers': 1,
+        'concurrency': 1,
+        'iterations': runs,
+        'results': summarize(recorder, time.perf_counter() - started),
+    }, output)
+
+# ========== ПЛАНЫ ЗАПРОСОВ ==========
+
+# Запросы горячих страниц в том виде, в каком их строят обработчики
+def hot_queries(student_id, group_id):
+    return {
+        'group_leaderboard': leaderboard_query(group_id).order_by(User.earned_points.desc(), User.id),
+        'admin_users_by_role': User.query.filter(User.role == 'student')
+            .order_by(User.last_name, User.id).limit(51),
+        'points_history_page': PointsHistory.query.filter(PointsHistory.user_id == student_id)
+            .order_by(PointsHistory.created_at.desc(), PointsHistory.id.desc()).limit(21),
+        'admin_orders_pending': Order.query.filter(Order.status == 'pending')
+            .order_by(Order.created_at.desc(), Order.id.desc()).limit(51),
+        'student_orders': Order.query.filter(Order.student_id == student_id),
+        'group_student_counts': db.session.query(User.group_id, db.func.count(User.id))
+            .filter(User.role == 'student', User.group_id.isnot(None)).group_by(User.group_id),
+    }
+
+def measure_plans(queries, repeat):
+    dialect = db.engine.dialect
+    explain = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    results = {}
+    with db.engine.connect() as connection:
+        for name, query in queries.items():
+            sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+            plan = [' '.join(str(value) for value in row)
+                    for row in connection.exec_driver_sql(explain + sql).fetchall()]
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                connection.exec_driver_sql(sql).fetchall()
+                timings.append(time.perf_counter() - started)
+            results[name] = {'plan': plan, 'median_ms': round(sorted(timings)[len(timings) // 2] * 1000, 3)}
+    return results
+
+# Планы и время запросов горячих страниц. С --drop-indexes индексы из миграций
+# удаляются на время замера и создаются снова — только для базы замеров
+@cli.command('plans')
+@click.option('--repeat', default=20, show_default=True)
+@click.option('--drop-indexes', is_flag=True, help='Сравнить с планами без индексов')
+@click.option('--output', type=click.Path(dir_okay=False), default=None)
+def plans_command(repeat, drop_indexes, output):
+    fixtures = load_fixtures()
+    with app.app_context():
+        student_id, group_id = db.session.query(User.id, User.group_id).filter(
+            User.username == fixtures['students'][0]).one()
+        queries = hot_queries(student_id, group_id)
+
+        results = {'indexed': measure_plans(queries, repeat)}
+        if drop_indexes:
+            index_names = migration_indexes()
+            with db.engine.begin() as connection:
+                for name in index_names:
+                    connection.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+            # В кэше подготовленных запросов соединений остались старые планы
+            db.engine.dispose()
+            try:
+                results['unindexed'] = measure_plans(queries, repeat)
+            finally:
+                for name in index_names:
+                    create_index_online(model_index(name))
+
+    for name in queries:
+        click.echo(f'{name}:')
+        for variant, plans in results.items():
+            click.echo(f'  {variant:10} {plans[name]["median_ms"]:>10.3f} ms  ' + ' | '.join(plans[name]['plan']))
+
+    save_report({
+        'version': git_version(),
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': fixtures['database'],
+        'dataset': fixtures['dataset'],
+        'mode': 'plans',
+        'repeat': repeat,
+        'results': results,
+    }, output)
+
+# Скорость потоковой выгрузки CSV и пиковая память процесса. Пик должен
+# оставаться почти одинаковым при любом числе строк
+@cli.command('export')
+@click.option('--name', 'names', multiple=True, type=click.Choice(['points_history', 'orders']))
+@click.option('--output', type=click.Path(dir_okay=False), default=None)
+def export_command(names, output):
+    fixtures = load_fixtures()
+    client = TestClient()
+    login(Recorder(), client, f'{BENCH_PREFIX}admin')
+
+    results = {}
+    for name in names or ['points_history', 'orders']:
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        rows = size = 0
+        with app.app_context():
+            response = client.client.get(f'/admin/export/{name}.csv', buffered=False)
+            for chunk in response.response:
+                rows += chunk.count(b'\n') if isinstance(chunk, bytes) else chunk.count('\n')
+                size += len(chunk)
+            response.close()
+        elapsed = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        results[f'export:{name}'] = {
+            'rows': rows - 1,
+            'seconds': round(elapsed, 2),
+            'rows_per_second': round((rows - 1) / elapsed),
+            'mb_per_second': round(size / elapsed / 2 ** 20, 2),
+            'max_rss_mb': round(rss_after / 1024, 1),
+            'max_rss_growth_mb': round((rss_after - rss_before) / 1024, 1),
+        }
+        click.echo(f'{name:20} {results[f"export:{name}"]}')
+
+    save_report({
+        'version': git_version(),
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': fixtures['database'],
+        'dataset': fixtures['dataset'],
+        'mode': 'export',
+        'results': results,
+    }, output)
+
+# ========== СТАТИКА ==========
+
+ASSET_LINK = re.compile(r'(?:href|src)="(/static/[^"]+\.(?:css|js))"')
+ASSET_PAGES = {
+    'student': ['/student', '/student/shop', '/student/profile'],
+    'teacher': ['/teacher', '/teacher/students'],
+    'admin': ['/admin', '/admin/orders', '/admin/users', '/admin/reward_reasons'],
+}
+
+# Сколько байт уходит при первом и повторном открытии страницы. При повторном
+# браузер берет из кэша файлы с immutable, остальные (исходники без сборки)
+# считаются загруженными заново.
+@cli.command('assets')
+@click.option('--output', type=click.Path(dir_okay=False), default=None)
+def assets_command(output):
+    fixtures = load_fixtures()
+    usernames = {
+        'student': fixtures['students'][0],
+        'teacher': fixtures['teachers'][0][0],
+        'admin': f'{BENCH_PREFIX}admin',
+    }
+    headers = {'Accept-Encoding': 'br, gzip'}
+
+    results = {}
+    for role, pages in ASSET_PAGES.items():
+        client = TestClient()
+        login(Recorder(), client, usernames[role])
+        for page in pages:
+            with app.app_context():
+                response = client.client.get(page, headers=headers)
+            html = response.get_data()
+            if response.status_code != 200:
+                raise click.ClickException(f'{page}: ответ {response.status_code}')
+
+            assets = cached = 0
+            for link in ASSET_LINK.findall(html.decode('utf-8')):
+                with app.app_context():
+                    asset = client.client.get(link, headers=headers)
+                assets += len(asset.get_data())
+                if 'immutable' in asset.headers.get('Cache-Control', ''):
+                    cached += len(asset.get_data())
+                asset.close()
+
+            results[f'{role}:{page}'] = {
+                'html_bytes': len(html),
+                'asset_bytes': assets,
+                'first_load_bytes': len(html) + assets,
+                'repeat_load_bytes': len(html) + assets - cached,
+            }
+            click.echo(f'{page:25} {results[f"{role}:{page}"]}')
+
+    save_report({
+        'version': git_version(),
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': fixtures['database'],
+        'dataset': fixtures['dataset'],
+        'mode': 'assets',
+        'results': results,
+    }, output)
+
+# ========== ШИНА ИНВАЛИДАЦИИ ==========
+
+def bus_worker(index, reason_id, student_id, expected, ready, results):
+    import app as app_module
+    # Кэш обновится только через шину, а не по истечении TTL
+    app_module.REWARD_REASONS_CACHE_TTL = 3600
+    app_module.USER_CACHE_TTL = 3600
+
+    def read():
+        with app.test_request_context('/'):
+            app.preprocess_request()
+            reason = next(r for r in app_module.reward_reasons() if r['id'] == reason_id)
+            return reason['points'], app_module.load_user(student_id).points
+
+    read()
+    ready.put(index)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if read() == expected:
+            results.put((index, time.time()))
+            return
+        time.sleep(0.02)
+    results.put((index, None))
+
+# Несколько процессов прогревают кэш причин начисления и снимок ученика,
+# затем родитель меняет обе строки. Каждый процесс должен увидеть новые
+# значения не позже чем через --bound секунд
+@cli.command('bus')
+@click.option('--workers', default=4, show_default=True)
+@click.option('--bound', default=None, type=float, help='Допустимая задержка, с')
+@click.option('--output', type=click.Path(dir_okay=False), default=None)
+def bus_command(workers, bound, output):
+    import multiprocessing
+    from app import CACHE_SYNC_INTERVAL
+
+    fixtures = load_fixtures()
+    bound = bound or CACHE_SYNC_INTERVAL + 1
+    with app.app_context():
+        reason = RewardReason.query.order_by(RewardReason.id).first()
+        student = User.query.filter_by(username=fixtures['students'][0]).one()
+        reason_id, student_id = reason.id, student.id
+        expected = (reason.points + 1, student.points + 1)
+        db.session.remove()
+        # Процессы-потомки не должны получить открытые соединения родителя
+        db.engine.dispose()
+
+    context = multiprocessing.get_context('fork')
+    ready, results = context.Queue(), context.Queue()
+    processes = [
+        context.Process(target=bus_worker, args=(i, reason_id, student_id, expected, ready, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get(timeout=60)
+
+    with app.app_context():
+        changed_at = time.time()
+        db.session.get(RewardReason, reason_id).points += 1
+        users = User.__table__
+        db.session.execute(users.update().where(users.c.id == student_id)
+                           .values(points=users.c.points + 1)
+                           .execution_options(changed_user_ids={student_id}))
+        db.session.commit()
+
+    delays = []
+    for _ in processes:
+        index, seen_at = results.get(timeout=60)
+        delays.append(None if seen_at is None else seen_at - changed_at)
+    for process in processes:
+        process.join()
+
+    with app.app_context():
+        db.session.get(RewardReason, reason_id).points -= 1
+        db.session.execute(users.update().where(users.c.id == student_id)
+                           .values(points=users.c.points - 1)
+                           .execution_options(changed_user_ids={student_id}))
+        db.session.commit()
+
+    seen = [delay for delay in delays if delay is not None]
+    result = {
+        'workers': workers,
+        'seen': len(seen),
+        'max_delay_s': round(max(seen), 3) if seen else None,
+        'mean_delay_s': round(sum(seen) / len(seen), 3) if seen else None,
+        'bound_s': bound,
+    }
+    click.echo(result)
+    save_report({
+        'version': git_version(),
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': fixtures['database'],
+        'dataset': fixtures['dataset'],
+        'mode': 'bus',
+        'results': {'bus:invalidation': result},
+    }, output)
+
+    if len(seen) < workers or max(seen) > bound:
+        raise click.ClickException('Не все процессы увидели изменение в пределах допустимой задержки')
+
+# ========== ПОКУПКИ ПОД НАГРУЗКОЙ ==========
+
+STRESS_PREFIX = f'{BENCH_PREFIX}stress_'
+
+def delete_stress_data():
+    products = db.session.query(Product.id).filter(Product.name.startswith(STRESS_PREFIX))
+    students = db.session.query(User.id).filter(User.username.startswith(STRESS_PREFIX))
+    Order.query.filter(Order.product_id.in_(products)).delete(synchronize_session=False)
+    Order.query.filter(Order.student_id.in_(students)).delete(synchronize_session=False)
+    Product.query.filter(Product.name.startswith(STRESS_PREFIX)).delete(synchronize_session=False)
+    User.query.filter(User.username.startswith(STRESS_PREFIX)).delete(synchronize_session=False)
+    db.session.commit()
+
+def buy_worker(index, product_id, student_ids, purchases, seed, ready, start, results):
+    rng = random.Random(seed * 1000 + index)
+    clients = {}
+    for student_id in student_ids:
+        clients[student_id] = app.test_client()
+        with clients[student_id].session_transaction() as session:
+            session['_user_id'] = str(student_id)
+            session['_fresh'] = True
+
+    ready.put(index)
+    start.wait()
+    statuses = {}
+    for _ in range(purchases):
+        response = clients[rng.choice(student_ids)].post(f'/student/shop/buy/{product_id}')
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    results.put(statuses)
+
+# Процессы одновременно покупают один товар с маленьким остатком для
+# нескольких учеников с маленьким балансом. После прогона остаток и балансы
+# не должны уйти в минус, а заказов должно быть ровно столько, сколько
+# списано товара и баллов
+@cli.command('buy-stress')
+@click.option('--workers', default=8, show_default=True, help='Процессов-покупателей')
+@click.option('--purchases', default=4000, show_default=True, help='Попыток покупки всего')
+@click.option('--stock', default=50, show_default=True, help='Остаток товара')
+@click.option('--students', default=20, show_default=True)
+@click.option('--balance', default=3, show_default=True, help='Баланс ученика в ценах товара')
+@click.option('--price', default=10, show_default=True)
+@click.option('--seed', default=1, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None)
+def buy_stress_command(workers, purchases, stock, students, balance, price, seed, output):
+    import multiprocessing
+
+    init_database(test_data=False)
+    with app.app_context():
+        delete_stress_data()
+        password_hash = generate_password_hash(BENCH_PASSWORD)
+        insert_batches(User.__table__, (
+            dict(bench_user_row(f'{STRESS_PREFIX}s{i}', 'student', password_hash, first_name='Покупатель'),
+                 points=balance * price, earned_points=balance * price)
+            for i in range(students)
+        ))
+        insert_batches(Product.__table__, [{
+            'name': f'{STRESS_PREFIX}product',
+            'description': 'Товар для проверки покупок под нагрузкой',
+            'price': price,
+            'quantity': stock,
+            'category': 'other',
+        }])
+        db.session.commit()
+        student_ids = [student_id for student_id, in db.session.query(User.id)
+                       .filter(User.username.startswith(STRESS_PREFIX)).all()]
+        product_id = db.session.query(Product.id).filter(Product.name.startswith(STRESS_PREFIX)).scalar()
+        database = db.engine.url.get_backend_name()
+        db.session.remove()
+        # Процессы-потомки не должны получить открытые соединения родителя
+        db.engine.dispose()
+
+    context = multiprocessing.get_context('fork')
+    ready, results, start = context.Queue(), context.Queue(), context.Event()
+    processes = [
+        context.Process(target=buy_worker, args=(i, product_id, student_ids,
+                                                 purchases // workers + (i < purchases % workers),
+                                                 seed, ready, start, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get(timeout=60)
+
+    started = time.perf_counter()
+    start.set()
+    statuses = {}
+    for _ in processes:
+        for status, count in results.get(timeout=600).items():
+            statuses[status] = statuses.get(status, 0) + count
+    wall_time = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    with app.app_context():
+        quantity = db.session.get(Product, product_id).quantity
+        points = [points for points, in db.session.query(User.points).filter(User.id.in_(student_ids)).all()]
+        orders = db.session.query(db.func.count(Order.id)).filter(Order.product_id == product_id).scalar()
+        delete_stress_data()
+
+    debited = balance * price * students - sum(points)
+    result = {
+        'workers': workers,
+        'purchases': purchases,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'orders': orders,
+        'stock_left': quantity,
+        'min_points': min(points),
+        'debited_points': debited,
+        'throughput_rps': round(purchases / wall_time, 2),
+    }
+    click.echo(result)
+    save_report({
+        'version': git_version(),
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': database,
+        'mode': 'buy-stress',
+        'results': {'buy-stress:purchases': result},
+    }, output)
+
+    problems = []
+    if quantity < 0:
+        problems.append(f'остаток товара {quantity}')
+    if min(points) < 0:
+        problems.append(f'отрицательный баланс {min(points)}')
+    if orders != stock - quantity:
+        problems.append(f'заказов {orders}, списано товара {stock - quantity}')
+    if orders * price != debited:
+        problems.append(f'заказов на {orders * price} баллов, списано {debited}')
+    if orders != statuses.get(200, 0):
+        problems.append(f'заказов {orders}, успешных ответов {statuses.get(200, 0)}')
+    if problems:
+        raise click.ClickException('Покупки разошлись: ' + '; '.join(problems))
+
+def write_report(report, output):
+    for name, stats in report['results'].items():
+        click.echo(f'{name:40} n={stats["requests"]:<6} err={stats["errors"]:<4} '
+                   f'p50={stats["p50_ms"]:>8.1f}ms p95={stats["p95_ms"]:>8.1f}ms '
+                   f'p99={stats["p99_ms"]:>8.1f}ms {stats["throughput_rps"]:>7.1f} rps')
+    save_report(report, output)
+
+def save_report(report, output):
+    if output is None:
+        output = os.path.join('bench-results',
+                              f'{report["version"] or "local"}-{report["mode"]}-{int(time.time())}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as report_file:
+        json.dump(report, report_file, ensure_ascii=False, indent=2)
+    click.echo(f'Результаты записаны в {output}')
+
+# Сравнивает два прогона; код выхода 1, если p95 какого-то шага вырос больше порога
+@cli.command('compare')
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('current', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', default=0.2, show_default=True, help='Допустимый рост p95 (0.2 = 20%)')
+def compare_command(baseline, current, threshold):
+    with open(baseline, encoding='utf-8') as baseline_file:
+        baseline_report = json.load(baseline_file)
+    with open(current, encoding='utf-8') as current_file:
+        current_report = json.load(current_file)
+
+    for key in ('mode', 'workers', 'concurrency', 'database', 'dataset'):
+        if baseline_report.get(key) != current_report.get(key):
+            click.echo(f'Внимание: прогоны различаются по {key}: '
+                       f'{baseline_report.get(key)} / {current_report.get(key)}')
+
+    before, after = baseline_report['results'], current_report['results']
+    regressions = 0
+    for name in sorted(set(before) & set(after)):
+        old, new = before[name]['p95_ms'], after[name]['p95_ms']
+        change = (new - old) / old if old else 0
+        mark = ''
+        if change > threshold:
+            regressions += 1
+            mark = '  <-- регрессия'
+        click.echo(f'{name:40} p95 {old:>8.1f} -> {new:>8.1f} ms ({change:+.0%}){mark}')
+
+    if regressions:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    cli()
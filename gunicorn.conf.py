@@ -0,0 +1,30 @@
+# Настройки gunicorn (gunicorn -c gunicorn.conf.py app:app).
+#
+# По умолчанию воркеры gthread: медленный запрос (вход с PBKDF2, большая
+# страница заказов) занимает один поток, а не весь воркер. Хэширование паролей
+# упирается в процессор и GIL, поэтому число процессов равно числу ядер, а
+# потоки закрывают ожидание базы и сети. Все значения можно переопределить
+# переменными окружения.
+import multiprocessing
+import os
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', max(2, cpu_count)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Перезапуск воркера после N запросов ограничивает рост памяти процесса
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+# Каждому потоку нужно свое соединение с базой, поэтому пул не меньше числа
+# потоков. Всего соединений: workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+raw_env = [f"DB_POOL_SIZE={os.environ.get('DB_POOL_SIZE', max(5, threads))}"]
+
+accesslog = '-' if os.environ.get('GUNICORN_ACCESS_LOG') == '1' else None
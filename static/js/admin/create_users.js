@@ -0,0 +1,90 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const filledRowsElement = document.getElementById('filledRows');
+    const addOneMoreBtn = document.getElementById('addOneMore');
+    let lastFilledRow = 0;
+
+    // Функция проверки заполненности строки
+    function checkRowFilled(rowNum) {
+        const row = document.getElementById(`row-${rowNum}`);
+        const username = row.querySelector('.username-input').value.trim();
+        const password = row.querySelector('[name^="password_"]').value;
+        const firstName = row.querySelector('[name^="first_name_"]').value.trim();
+        const lastName = row.querySelector('[name^="last_name_"]').value.trim();
+        const role = row.querySelector('.role-select').value;
+
+        return username && password && firstName && lastName && role;
+    }
+
+    // Функция обновления счетчика заполненных строк
+    function updateFilledRows() {
+        let filled = 0;
+        for (let i = 1; i <= 10; i++) {
+            if (checkRowFilled(i)) {
+                filled++;
+                if (i > lastFilledRow) lastFilledRow = i;
+            }
+        }
+        filledRowsElement.textContent = filled;
+    }
+
+    // Очистка строки
+    document.querySelectorAll('.btn-clear-row').forEach(btn => {
+        btn.addEventListener('click', function() {
+            const rowNum = this.dataset.row;
+            const row = document.getElementById(`row-${rowNum}`);
+
+            row.querySelectorAll('input, select').forEach(element => {
+                if (element.type !== 'button') {
+                    element.value = '';
+                }
+            });
+
+            updateFilledRows();
+        });
+    });
+
+    // Автоматическое скрытие/показ группы в зависимости от роли
+    document.querySelectorAll('.role-select').forEach(select => {
+        select.addEventListener('change', function() {
+            const rowNum = this.dataset.row;
+            const groupSelect = document.querySelector(`.group-select[data-row="${rowNum}"]`);
+
+            if (this.value === 'student') {
+                groupSelect.style.display = 'block';
+            } else {
+                groupSelect.style.display = 'block';
+                groupSelect.value = '';
+            }
+
+            updateFilledRows();
+        });
+    });
+
+    // Добавление еще одной строки
+    addOneMoreBtn.addEventListener('click', function() {
+        if (lastFilledRow < 10) {
+            const nextRow = lastFilledRow + 1;
+            const row = document.getElementById(`row-${nextRow}`);
+
+            // Прокрутка к строке
+            row.scrollIntoView({ behavior: 'smooth', block: 'center' });
+
+            // Фокус на поле логина
+            const usernameInput = row.querySelector('.username-input');
+            usernameInput.focus();
+
+            updateFilledRows();
+        } else {
+            alert('Достигнуто максимальное количество строк (10)');
+        }
+    });
+
+    // Отслеживание изменений в полях
+    document.querySelectorAll('#createUsersForm input, #createUsersForm select').forEach(element => {
+        element.addEventListener('input', updateFilledRows);
+        element.addEventListener('change', updateFilledRows);
+    });
+
+    // Инициализация счетчика
+    updateFilledRows();
+});
@@ -0,0 +1,27 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const searchInput = document.getElementById('search-groups');
+    const teacherFilter = document.getElementById('teacher-filter');
+
+    function filterGroups() {
+        const searchTerm = searchInput.value.toLowerCase();
+        const teacherId = teacherFilter.value;
+        const rows = document.querySelectorAll('#groups-table tbody tr');
+
+        rows.forEach(row => {
+            const text = row.textContent.toLowerCase();
+            const rowTeacherId = row.dataset.teacher || '';
+
+            const matchesSearch = text.includes(searchTerm);
+            const matchesTeacher = !teacherId || rowTeacherId === teacherId;
+
+            if (matchesSearch && matchesTeacher) {
+                row.style.display = '';
+            } else {
+                row.style.display = 'none';
+            }
+        });
+    }
+
+    searchInput.addEventListener('input', filterGroups);
+    teacherFilter.addEventListener('change', filterGroups);
+});
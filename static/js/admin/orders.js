@@ -0,0 +1,26 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const statusFilter = document.getElementById('status-filter');
+
+    statusFilter.addEventListener('change', function() {
+        // Фильтрация выполняется на сервере, курсор при смене статуса сбрасывается
+        window.location.href = this.dataset.url + '?status=' + this.value;
+    });
+
+    const selectAll = document.getElementById('select-all-orders');
+    const checkboxes = document.querySelectorAll('.order-checkbox');
+    const batchButtons = document.querySelectorAll('.batch-action');
+
+    function updateSelection() {
+        const selected = document.querySelectorAll('.order-checkbox:checked').length;
+        document.getElementById('selected-orders-count').textContent = selected;
+        batchButtons.forEach(button => button.disabled = selected === 0);
+    }
+
+    if (selectAll) {
+        selectAll.addEventListener('change', function() {
+            checkboxes.forEach(checkbox => checkbox.checked = this.checked);
+            updateSelection();
+        });
+        checkboxes.forEach(checkbox => checkbox.addEventListener('change', updateSelection));
+    }
+});
@@ -0,0 +1,61 @@
+$(document).ready(function() {
+    // Включаем сортировку
+    $("#sortable").sortable({
+        handle: ".handle",
+        update: function(event, ui) {
+            updateOrderNumbers();
+        }
+    });
+    $("#sortable").disableSelection();
+
+    // Обновление номеров порядка
+    function updateOrderNumbers() {
+        $('#sortable tr').each(function(index) {
+            $(this).find('.order-number').text(index + 1);
+        });
+    }
+
+    // Сохранение порядка
+    $('#save-order').click(function() {
+        var orderData = [];
+        $('#sortable tr').each(function(index) {
+            var reasonId = $(this).data('id');
+            orderData.push({
+                id: reasonId,
+                order: index + 1
+            });
+        });
+
+        $.ajax({
+            url: $('#save-order').data('url'),
+            method: 'POST',
+            contentType: 'application/json',
+            data: JSON.stringify(orderData),
+            success: function(response) {
+                if (response.success) {
+                    alert('Порядок успешно сохранен!');
+                } else {
+                    alert('Ошибка: ' + response.error);
+                }
+            },
+            error: function(xhr, status, error) {
+                alert('Ошибка при сохранении порядка: ' + error);
+            }
+        });
+    });
+
+    // Поиск
+    $('#search-reasons').on('input', function() {
+        const searchTerm = this.value.toLowerCase();
+        const rows = $('#reasons-table tbody tr');
+
+        rows.each(function() {
+            const text = $(this).text().toLowerCase();
+            if (text.includes(searchTerm)) {
+                $(this).show();
+            } else {
+                $(this).hide();
+            }
+        });
+    });
+});
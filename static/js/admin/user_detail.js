@@ -0,0 +1,26 @@
+function togglePassword() {
+    const passwordField = document.getElementById('current-password');
+    if (passwordField.type === 'password') {
+        passwordField.type = 'text';
+    } else {
+        passwordField.type = 'password';
+    }
+}
+
+function generatePassword() {
+    const length = 8;
+    const charset = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789";
+    let password = "";
+    for (let i = 0; i < length; i++) {
+        password += charset.charAt(Math.floor(Math.random() * charset.length));
+    }
+    document.getElementById('new-password').value = password;
+    alert('Сгенерирован пароль: ' + password + '\nЗапишите его перед сохранением!');
+}
+
+function copyPassword() {
+    const passwordField = document.getElementById('current-password');
+    passwordField.select();
+    document.execCommand('copy');
+    alert('Пароль скопирован в буфер обмена');
+}
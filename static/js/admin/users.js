@@ -0,0 +1,51 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const loadMoreBtn = document.getElementById('load-more-users');
+    const tbody = document.querySelector('#users-table tbody');
+    const roleColors = {
+        admin: 'var(--primary-color)',
+        teacher: 'var(--warning-color)',
+        student: 'var(--success-color)'
+    };
+
+    function escapeHtml(text) {
+        const div = document.createElement('div');
+        div.textContent = text;
+        return div.innerHTML;
+    }
+
+    // Следующие страницы подгружаются из JSON-версии списка с теми же фильтрами
+    loadMoreBtn.addEventListener('click', function() {
+        const params = new URLSearchParams(new FormData(document.getElementById('users-filter')));
+        params.set('cursor', this.dataset.cursor);
+        loadMoreBtn.disabled = true;
+
+        fetch(loadMoreBtn.dataset.url + '?' + params.toString())
+            .then(response => response.json())
+            .then(data => {
+                data.users.forEach(user => {
+                    const row = document.createElement('tr');
+                    row.className = 'searchable-item';
+                    row.innerHTML = `
+                        <td>${escapeHtml(user.username)}</td>
+                        <td>${escapeHtml(user.name)}</td>
+                        <td><span class="user-role" style="background: ${roleColors[user.role] || roleColors.student}">${escapeHtml(user.role)}</span></td>
+                        <td>${user.group ? escapeHtml(user.group) : '—'}</td>
+                        <td><span style="font-weight: bold; color: var(--primary-color);">${user.points}</span></td>
+                        <td><a href="${user.url}" class="btn btn-primary btn-sm"><i class="fas fa-eye"></i></a></td>
+                    `;
+                    tbody.appendChild(row);
+                });
+
+                loadMoreBtn.disabled = false;
+                if (data.next_cursor) {
+                    loadMoreBtn.dataset.cursor = data.next_cursor;
+                } else {
+                    document.getElementById('users-more').style.display = 'none';
+                }
+            })
+            .catch(error => {
+                loadMoreBtn.disabled = false;
+                console.error('Error:', error);
+            });
+    });
+});
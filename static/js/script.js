@@ -211,8 +211,22 @@ document.addEventListener('DOMContentLoaded', function() {
             if (studentTable) {
                 studentTable.innerHTML = '<tr><td colspan="5" class="loading"><div class="spinner"></div></td></tr>';
                 
-                fetch(`/api/filter/students?group_id=${groupId}`)
-                    .then(response => response.json())
+                // Страницы с ETag: при повторном выборе группы браузер получает 304
+                const loadStudents = (cursor, students) => {
+                    const params = new URLSearchParams({group_id: groupId, limit: 500});
+                    if (cursor) {
+                        params.set('cursor', cursor);
+                    }
+                    return fetch(`/api/filter/students?${params}`).then(response => {
+                        const nextCursor = response.headers.get('X-Next-Cursor');
+                        return response.json().then(page => {
+                            students = students.concat(page);
+                            return nextCursor ? loadStudents(nextCursor, students) : students;
+                        });
+                    });
+                };
+                
+                loadStudents(null, [])
                     .then(students => {
                         studentTable.innerHTML = '';
                         
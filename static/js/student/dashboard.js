@@ -0,0 +1,15 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const showMoreBtn = document.getElementById('showMoreHistory');
+
+    if (showMoreBtn) {
+        showMoreBtn.addEventListener('click', function() {
+            const hiddenItems = document.querySelectorAll('.hidden-item');
+
+            hiddenItems.forEach(item => {
+                item.style.display = 'block';
+            });
+
+            this.style.display = 'none';
+        });
+    }
+});
@@ -0,0 +1,39 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const historyFilter = document.getElementById('history-filter');
+
+    if (historyFilter) {
+        historyFilter.addEventListener('change', function() {
+            const filterValue = this.value;
+            const rows = document.querySelectorAll('.history-row');
+            const now = new Date();
+            const lastMonth = new Date(now.getFullYear(), now.getMonth() - 1, now.getDate());
+
+            rows.forEach(row => {
+                const rowType = row.dataset.type;
+                const rowDate = new Date(row.dataset.date);
+                let show = true;
+
+                switch (filterValue) {
+                    case 'positive':
+                        show = rowType === 'positive';
+                        break;
+                    case 'negative':
+                        show = rowType === 'negative';
+                        break;
+                    case 'last_month':
+                        show = rowDate >= lastMonth;
+                        break;
+                }
+
+                row.style.display = show ? '' : 'none';
+            });
+        });
+    }
+
+    // Анимация кругового прогресса
+    const circleProgress = document.querySelector('.circle-progress');
+    if (circleProgress) {
+        const percent = circleProgress.dataset.percent;
+        circleProgress.style.setProperty('--percent', percent);
+    }
+});
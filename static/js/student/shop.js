@@ -0,0 +1,217 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const searchInput = document.getElementById('search-products');
+    const categoryFilter = document.getElementById('category-filter');
+    const sortSelect = document.getElementById('sort-products');
+    const purchaseModal = document.getElementById('purchaseModal');
+    const closeButtons = document.querySelectorAll('.close');
+    let currentUserPoints = parseInt(purchaseModal.dataset.points, 10);
+
+    // Функция фильтрации и сортировки товаров
+    function updateProductsDisplay() {
+        const searchTerm = searchInput.value.toLowerCase();
+        const selectedCategory = categoryFilter.value;
+        const sortBy = sortSelect.value;
+        const products = document.querySelectorAll('.product-card');
+        let visibleCount = 0;
+
+        // Сначала фильтруем
+        products.forEach(product => {
+            const productName = product.dataset.name;
+            const productCategory = product.dataset.category;
+
+            const matchesSearch = searchTerm === '' || productName.includes(searchTerm);
+            const matchesCategory = selectedCategory === 'all' || productCategory === selectedCategory;
+
+            if (matchesSearch && matchesCategory) {
+                product.style.display = 'block';
+                visibleCount++;
+            } else {
+                product.style.display = 'none';
+            }
+        });
+
+        // Обновляем счетчик
+        document.getElementById('products-count').textContent = visibleCount;
+
+        // Затем сортируем (если нужно)
+        if (sortBy !== 'default') {
+            const container = document.getElementById('products-container');
+            const visibleProducts = Array.from(products).filter(p => p.style.display !== 'none');
+
+            visibleProducts.sort((a, b) => {
+                switch (sortBy) {
+                    case 'price_asc':
+                        return parseInt(a.dataset.price) - parseInt(b.dataset.price);
+                    case 'price_desc':
+                        return parseInt(b.dataset.price) - parseInt(a.dataset.price);
+                    case 'name':
+                        return a.dataset.name.localeCompare(b.dataset.name);
+                    default:
+                        return 0;
+                }
+            });
+
+            // Переставляем элементы в DOM
+            visibleProducts.forEach(product => {
+                container.appendChild(product);
+            });
+        }
+    }
+
+    // Обработчики событий для фильтров
+    searchInput.addEventListener('input', updateProductsDisplay);
+    categoryFilter.addEventListener('change', updateProductsDisplay);
+    sortSelect.addEventListener('change', updateProductsDisplay);
+
+    // Покупка товара
+    document.querySelectorAll('.buy-btn').forEach(btn => {
+        btn.addEventListener('click', function() {
+            const productId = this.dataset.productId;
+            const productName = this.dataset.productName;
+            const productPrice = parseInt(this.dataset.productPrice);
+
+            // Загружаем содержимое модального окна
+            document.getElementById('purchaseContent').innerHTML = `
+                <div style="text-align: center; margin-bottom: 20px;">
+                    <i class="fas fa-gift" style="font-size: 4rem; color: var(--primary-color); margin-bottom: 15px;"></i>
+                    <h4 style="color: var(--primary-color); margin-bottom: 10px;">${productName}</h4>
+                    <p style="color: var(--text-light);">Стоимость: <strong>${productPrice} баллов</strong></p>
+                </div>
+
+                <div style="background: rgba(123, 31, 162, 0.05); padding: 15px; border-radius: var(--radius); margin-bottom: 20px;">
+                    <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
+                        <span>Ваш текущий баланс:</span>
+                        <strong style="color: var(--primary-color);">${currentUserPoints} баллов</strong>
+                    </div>
+                    <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
+                        <span>Стоимость товара:</span>
+                        <strong style="color: var(--danger-color);">-${productPrice} баллов</strong>
+                    </div>
+                    <div style="display: flex; justify-content: space-between; font-weight: bold; padding-top: 10px; border-top: 1px solid var(--border-color);">
+                        <span>Баланс после покупки:</span>
+                        <strong style="color: ${currentUserPoints - productPrice >= 0 ? 'var(--success-color)' : 'var(--danger-color)'};">${currentUserPoints - productPrice} баллов</strong>
+                    </div>
+                </div>
+
+                <div style="display: flex; justify-content: flex-end; gap: 10px;">
+                    <button type="button" class="btn btn-secondary close-modal">Отмена</button>
+                    <button type="button" class="btn btn-primary confirm-purchase" data-product-id="${productId}">
+                        <i class="fas fa-check"></i> Подтвердить покупку
+                    </button>
+                </div>
+            `;
+
+            purchaseModal.style.display = 'block';
+        });
+    });
+
+    // Закрытие модального окна
+    closeButtons.forEach(btn => {
+        btn.addEventListener('click', function() {
+            purchaseModal.style.display = 'none';
+        });
+    });
+
+    // Закрытие при клике вне окна
+    window.addEventListener('click', function(event) {
+        if (event.target === purchaseModal) {
+            purchaseModal.style.display = 'none';
+        }
+    });
+
+    // Делегирование событий для кнопок в модальном окне
+    document.addEventListener('click', function(event) {
+        if (event.target.classList.contains('close-modal')) {
+            purchaseModal.style.display = 'none';
+        }
+
+        if (event.target.classList.contains('confirm-purchase') || 
+            event.target.closest('.confirm-purchase')) {
+            const btn = event.target.classList.contains('confirm-purchase') ? 
+                       event.target : event.target.closest('.confirm-purchase');
+            const productId = btn.dataset.productId;
+
+            // Отправляем запрос на покупку
+            fetch(`/student/shop/buy/${productId}`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                credentials: 'same-origin'
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    // Обновляем баланс
+                    currentUserPoints = data.new_balance;
+
+                    // Показываем успешное сообщение
+                    document.getElementById('purchaseContent').innerHTML = `
+                        <div style="text-align: center; padding: 20px;">
+                            <i class="fas fa-check-circle" style="font-size: 4rem; color: var(--success-color); margin-bottom: 15px;"></i>
+                            <h4 style="color: var(--success-color); margin-bottom: 10px;">Покупка успешна!</h4>
+                            <p style="color: var(--text-light); margin-bottom: 20px;">
+                                Товар успешно куплен. Заберите его у администратора в школе.
+                            </p>
+                            <p style="font-weight: bold; color: var(--primary-color);">
+                                Новый баланс: ${data.new_balance} баллов
+                            </p>
+                        </div>
+                        <div style="text-align: center; margin-top: 20px;">
+                            <button type="button" class="btn btn-primary close-modal">
+                                <i class="fas fa-check"></i> Отлично!
+                            </button>
+                        </div>
+                    `;
+
+                    // Обновляем отображение баланса на странице
+                    const balanceElements = document.querySelectorAll('.user-points, .balance-card strong');
+                    balanceElements.forEach(el => {
+                        if (el.classList.contains('user-points')) {
+                            el.textContent = `${data.new_balance} баллов`;
+                        } else if (el.closest('.balance-card')) {
+                            el.textContent = `${data.new_balance}`;
+                        }
+                    });
+
+                    // Обновляем кнопки покупки на странице
+                    setTimeout(() => {
+                        location.reload();
+                    }, 2000);
+                } else {
+                    // Показываем ошибку
+                    document.getElementById('purchaseContent').innerHTML = `
+                        <div style="text-align: center; padding: 20px;">
+                            <i class="fas fa-exclamation-circle" style="font-size: 4rem; color: var(--danger-color); margin-bottom: 15px;"></i>
+                            <h4 style="color: var(--danger-color); margin-bottom: 10px;">Ошибка</h4>
+                            <p style="color: var(--text-light); margin-bottom: 20px;">${data.error}</p>
+                        </div>
+                        <div style="text-align: center; margin-top: 20px;">
+                            <button type="button" class="btn btn-primary close-modal">
+                                <i class="fas fa-times"></i> Закрыть
+                            </button>
+                        </div>
+                    `;
+                }
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                document.getElementById('purchaseContent').innerHTML = `
+                    <div style="text-align: center; padding: 20px;">
+                        <i class="fas fa-exclamation-circle" style="font-size: 4rem; color: var(--danger-color); margin-bottom: 15px;"></i>
+                        <h4 style="color: var(--danger-color); margin-bottom: 10px;">Ошибка</h4>
+                        <p style="color: var(--text-light); margin-bottom: 20px;">Произошла ошибка при покупке. Попробуйте позже.</p>
+                    </div>
+                    <div style="text-align: center; margin-top: 20px;">
+                        <button type="button" class="btn btn-primary close-modal">
+                            <i class="fas fa-times"></i> Закрыть
+                        </button>
+                    </div>
+                `;
+            });
+        }
+    });
+
+    // Инициализация отображения
+    updateProductsDisplay();
+});
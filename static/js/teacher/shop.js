@@ -0,0 +1,26 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const categoryFilter = document.getElementById('category-filter');
+
+    categoryFilter.addEventListener('change', function() {
+        const selectedCategory = this.value;
+        const products = document.querySelectorAll('.product-card');
+
+        products.forEach(product => {
+            const productCategory = product.dataset.category;
+
+            if (selectedCategory === 'all' || productCategory === selectedCategory) {
+                product.style.display = 'block';
+                setTimeout(() => {
+                    product.style.opacity = '1';
+                    product.style.transform = 'translateY(0)';
+                }, 50);
+            } else {
+                product.style.opacity = '0';
+                product.style.transform = 'translateY(20px)';
+                setTimeout(() => {
+                    product.style.display = 'none';
+                }, 300);
+            }
+        });
+    });
+});
@@ -0,0 +1,172 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Функция для смены группы
+    window.changeGroup = function(select) {
+        const groupId = select.value;
+        if (groupId) {
+            window.location.href = '/teacher/students?group_id=' + groupId;
+        }
+    };
+
+    // Подсчет выбранных учеников
+    function updateSelectedCount() {
+        let selectedCount = 0;
+        let totalPoints = 0;
+
+        document.querySelectorAll('tbody tr').forEach(row => {
+            let hasSelection = false;
+            let studentPoints = 0;
+
+            row.querySelectorAll('.reason-select').forEach(select => {
+                if (select.value && select.value !== '') {
+                    hasSelection = true;
+                    const selectedOption = select.options[select.selectedIndex];
+                    const points = parseInt(selectedOption.dataset.points) || 0;
+                    studentPoints += points;
+                }
+            });
+
+            if (hasSelection) {
+                selectedCount++;
+                totalPoints += studentPoints;
+            }
+        });
+
+        document.getElementById('selected-count').textContent = selectedCount;
+        document.getElementById('total-points').textContent = totalPoints;
+
+        // Активируем/деактивируем кнопку
+        const submitBtn = document.getElementById('submit-rewards');
+        if (submitBtn) {
+            submitBtn.disabled = selectedCount === 0;
+        }
+    }
+
+    // Выбрать все (выбираем первую причину для каждого ученика)
+    document.getElementById('select-all')?.addEventListener('click', function() {
+        document.querySelectorAll('tbody tr').forEach(row => {
+            const firstSelect = row.querySelector('.reason-select');
+            if (firstSelect && firstSelect.options.length > 1) {
+                // Выбираем первую доступную причину (не пустую)
+                for (let i = 1; i < firstSelect.options.length; i++) {
+                    if (firstSelect.options[i].value !== '') {
+                        firstSelect.value = firstSelect.options[i].value;
+                        break;
+                    }
+                }
+            }
+        });
+        updateSelectedCount();
+    });
+
+    // Очистить все
+    document.getElementById('clear-all')?.addEventListener('click', function() {
+        document.querySelectorAll('.reason-select').forEach(select => {
+            select.value = '';
+        });
+        updateSelectedCount();
+    });
+
+    // Отслеживание изменений в выпадающих списках
+    document.querySelectorAll('.reason-select').forEach(select => {
+        select.addEventListener('change', updateSelectedCount);
+    });
+
+    // Отправка формы
+    document.getElementById('submit-rewards')?.addEventListener('click', function() {
+        const formData = {};
+        let hasSelection = false;
+
+        // Собираем данные в правильном формате
+        document.querySelectorAll('tbody tr').forEach(row => {
+            const studentId = row.querySelector('.reason-select')?.name?.split('_')[1];
+            if (!studentId) return;
+
+            formData[studentId] = [];
+
+            row.querySelectorAll('.reason-select').forEach((select, index) => {
+                const reasonId = select.value;
+                if (reasonId && reasonId !== '') {
+                    hasSelection = true;
+                    const selectedOption = select.options[select.selectedIndex];
+                    const points = parseInt(selectedOption.dataset.points) || 0;
+
+                    formData[studentId].push({
+                        reason_id: parseInt(reasonId),
+                        points: points
+                    });
+                }
+            });
+
+            // Если для этого ученика ничего не выбрано, удаляем из данных
+            if (formData[studentId].length === 0) {
+                delete formData[studentId];
+            }
+        });
+
+        if (!hasSelection) {
+            alert('Выберите хотя бы одну причину для начисления баллов!');
+            return;
+        }
+
+        if (!confirm(`Начислить баллы ${Object.keys(formData).length} ученикам?`)) {
+            return;
+        }
+
+        // Показываем загрузку
+        const loading = document.getElementById('loading');
+        const resultMessage = document.getElementById('result-message');
+        const submitBtn = document.getElementById('submit-rewards');
+
+        loading.style.display = 'block';
+        submitBtn.disabled = true;
+        resultMessage.style.display = 'none';
+
+        // Отправляем AJAX запрос
+        fetch('/teacher/students', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(formData)
+        })
+        .then(response => response.json())
+        .then(data => {
+            loading.style.display = 'none';
+            submitBtn.disabled = false;
+
+            if (data.success) {
+                resultMessage.className = 'flash-success';
+                resultMessage.innerHTML = '<i class="fas fa-check-circle"></i> ' + data.message;
+                resultMessage.style.display = 'block';
+
+                // Обновляем страницу через 2 секунды
+                setTimeout(() => {
+                    location.reload();
+                }, 2000);
+            } else {
+                resultMessage.className = 'flash-error';
+                resultMessage.innerHTML = '<i class="fas fa-exclamation-circle"></i> ' + (data.error || 'Ошибка при начислении баллов');
+                resultMessage.style.display = 'block';
+            }
+        })
+        .catch(error => {
+            loading.style.display = 'none';
+            submitBtn.disabled = false;
+
+            resultMessage.className = 'flash-error';
+            resultMessage.innerHTML = '<i class="fas fa-exclamation-circle"></i> Ошибка соединения с сервером';
+            resultMessage.style.display = 'block';
+            console.error('Error:', error);
+        });
+    });
+
+    // Инициализация
+    updateSelectedCount();
+});
+
+function changeGroup(select) {
+    const groupId = select.value;
+    if (groupId) {
+        window.location.href = '/teacher/students?group_id=' + groupId;
+    }
+}
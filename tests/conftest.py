@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+
+# Приложение читает DATABASE_URL при импорте, поэтому база задается до него
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as app_module
+
+@pytest.fixture
+def app():
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.forget_all_caches()
+        app_module._bus_state.update(last_id=None, checked_at=0.0, table_ready=False)
+        yield app_module.app
+        app_module.db.session.remove()
+        app_module.db.drop_all()
@@ -0,0 +1,34 @@
+import csv
+import io
+
+from app import db, PointsHistory, User
+
+def make_user(username, role):
+    user = User(username=username, password='x', first_name='Имя', last_name='Фамилия', 
+                role=role, points=0, earned_points=0)
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+def test_points_history_export_escapes_formulas(app):
+    db.create_all()
+    admin = make_user('admin', 'admin')
+    student = make_user('=cmd|calc', 'student')
+    db.session.add(PointsHistory(user_id=student.id, points_change=-5, 
+                                 reason='=HYPERLINK("http://evil.example","Нажми")', 
+                                 changed_by_id=admin.id))
+    db.session.commit()
+    
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+        session['_fresh'] = True
+    response = client.get('/admin/export/points_history.csv')
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True).lstrip('\ufeff'))))
+    response.close()
+    
+    header, row = rows
+    record = dict(zip(header, row))
+    assert record['Причина'] == '\'=HYPERLINK("http://evil.example","Нажми")'
+    assert record['Логин'] == "'=cmd|calc"
+    assert record['Баллы'] == '-5'
@@ -0,0 +1,39 @@
+from sqlalchemy import inspect
+
+from app import db, CacheInvalidation, Group, MIGRATIONS, migration_indexes, model_index, upgrade_database
+
+SERIES_TABLES = ('points_snapshot', 'cache_invalidation', 'schema_migration')
+SERIES_COLUMNS = (('order', 'price'),)
+
+# Схема до версионированных миграций: исходные таблицы без новых таблиц,
+# колонок и индексов
+def create_baseline_schema():
+    db.create_all()
+    for name in SERIES_TABLES:
+        db.metadata.tables[name].drop(db.engine)
+    with db.engine.begin() as connection:
+        for name in migration_indexes():
+            connection.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+        for table, column in SERIES_COLUMNS:
+            connection.exec_driver_sql(f'ALTER TABLE "{table}" DROP COLUMN {column}')
+
+def test_upgrade_from_baseline_schema(app):
+    create_baseline_schema()
+    
+    upgraded = upgrade_database()
+    
+    assert [version for version, _ in upgraded] == [version for version, _, _ in MIGRATIONS]
+    inspector = inspect(db.engine)
+    for name in SERIES_TABLES:
+        assert inspector.has_table(name)
+    for table, column in SERIES_COLUMNS:
+        assert column in {info['name'] for info in inspector.get_columns(table)}
+    for name in migration_indexes():
+        table = model_index(name).table.name
+        assert name in {index['name'] for index in inspector.get_indexes(table)}
+    
+    db.session.add(Group(name='После обновления'))
+    db.session.commit()
+    assert CacheInvalidation.query.count() >= 1
+    
+    assert upgrade_database() == []
@@ -0,0 +1,23 @@
+from app import db, Order, Product, User, fulfil_orders, purchase_product
+
+def test_cancel_refunds_the_price_paid(app):
+    db.create_all()
+    student = User(username='student', password='x', first_name='Имя', last_name='Фамилия', 
+                   role='student', points=100, earned_points=100)
+    product = Product(name='Стикер', price=10, quantity=5, category='other')
+    db.session.add_all([student, product])
+    db.session.commit()
+    student_id, product_id = student.id, product.id
+    
+    order_id, error = purchase_product(student_id, product_id, 10)
+    assert error is None
+    assert db.session.get(Order, order_id).price == 10
+    
+    db.session.get(Product, product_id).price = 50
+    db.session.commit()
+    
+    assert fulfil_orders([order_id], 'cancelled') == 1
+    db.session.commit()
+    db.session.expire_all()
+    assert db.session.get(User, student_id).points == 100
+    assert db.session.get(Product, product_id).quantity == 5